@@ -64,7 +64,7 @@ def run_single_case(file_name_stem, args, base_config):
     set_seed(current_config['seed'])
     
     print(f"\nProcessing Data: {file_name_stem}.json")
-    print(f"Params: Pop={current_config['pop_size']}, Gen={current_config['max_gen']}, Seed={current_config['seed']}")
+    print(f"Params: Pop={current_config['pop_size']}, Gen={current_config['max_gen']}, Seed={current_config['seed']}, Workers={current_config['n_workers']}")
 
     # 3. Load Data
     data_path = f'data/WithTimeWindows/{file_name_stem}.json'
@@ -86,7 +86,12 @@ def run_single_case(file_name_stem, args, base_config):
         c_rate=current_config['c_rate'],
         m_rate=current_config['m_rate'],
         tourn_size=current_config['tourn_size'],
-        seed=current_config['seed']
+        seed=current_config['seed'],
+        n_workers=current_config['n_workers'],
+        sim_max_events=current_config['sim_max_events'],
+        sim_time_limit=current_config['sim_time_limit'],
+        early_termination=current_config['early_termination'],
+        replacement_budget=current_config['replacement_budget']
     )
     
     start_time = time.time()
@@ -251,6 +256,13 @@ def main():
     parser.add_argument('--tourn_size', type=int)
     parser.add_argument('-asn','--assignment_n', type=int)
     parser.add_argument('--seed', type=int)
+    parser.add_argument('-nw', '--n_workers', type=int, help='Số process đánh giá song song (1 = tuần tự)')
+    parser.add_argument('--sim_max_events', type=int, help='Số sự kiện tối đa cho mỗi lần mô phỏng khi tiến hóa')
+    parser.add_argument('--sim_time_limit', type=float, help='Thời gian tối đa (giây) cho mỗi lần mô phỏng khi tiến hóa')
+    parser.add_argument('--early_termination', type=str, choices=['front', 'survival'],
+                        help='Dừng sớm mô phỏng của cá thể chắc chắn bị trội (survival: không đổi kết quả, front: nhanh hơn)')
+    parser.add_argument('--replacement_budget', type=int,
+                        help='Số lần thử gán lại tối đa trong một chuỗi thay thế của mô phỏng')
 
     args = parser.parse_args()
 
@@ -264,6 +276,11 @@ def main():
         'tourn_size': 4,
         'seed': 42,
         'assignment_n': 1,
+        'n_workers': 1,
+        'sim_max_events': None,
+        'sim_time_limit': None,
+        'early_termination': None,
+        'replacement_budget': 500,
     }
     
     # Lấy mode từ phần tử đầu tiên của list inputs
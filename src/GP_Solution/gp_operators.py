@@ -1,92 +1,59 @@
 import random
 from typing import Literal, Optional
-from .gp_structure import NodeGP
 from .initializer import PopulationInitializer
-from .gp_structure import NodeGP, Individual, InternalNode, TerminalNode, OPERATORS, FUNC_SET
+from .gp_structure import Individual, LinearTree, NodeGP, InternalNode, TerminalNode, OP_CODES, FUNC_SET, N_OPS
 
 
-def from_string_to_func(op_name):
-    return OPERATORS.get(op_name)
-
-# ----------------------------------
-# Helper functions cho thao tác cây
-# ----------------------------------
-
 class GeneticOperator:
-    @staticmethod
-    def _count_nodes(node: NodeGP) -> int:
-        if node is None: return 0
-        return 1 + GeneticOperator._count_nodes(node.left) + GeneticOperator._count_nodes(node.right)
-
-    @staticmethod
-    def _get_node_at_index(
-            node: NodeGP, 
-            target_idx: int, 
-            current_idx: int = 0
-        ) -> tuple[NodeGP, int]:
-        """Trả về node tại chỉ số target index (duyệt theo pre-order) và index tiếp theo"""
-        
-        if current_idx == target_idx:
-            return node, current_idx + 1
-        
-        current_idx += 1
-        if node.left:
-            found, new_idx = GeneticOperator._get_node_at_index(node.left, target_idx, current_idx)
-            if found: return found, new_idx
-            current_idx = new_idx 
-        
-        if node.right:
-            found, new_idx = GeneticOperator._get_node_at_index(node.right, target_idx, current_idx)
-            if found: return found, new_idx
-            current_idx = new_idx
-        
-        return None, current_idx
+    # Các toán tử làm việc trên LinearTree: chọn điểm theo chỉ số pre-order,
+    # lấy/thay cây con bằng slice, độ sâu/chiều cao từng node lấy từ metadata đã cache của cây.
 
     @staticmethod
-    def _replace_node_at_index(
-            root: NodeGP, 
-            target_idx: int, 
-            new_subtree: NodeGP, 
-            current_idx: int = 0
-        ) -> tuple[NodeGP, int]:
-        """Tạo một bản sao của cây với node tại target_idx được thay thế"""
-        
-        if current_idx == target_idx:
-            return new_subtree.copy(), current_idx + 1
-        
-        if isinstance(root, InternalNode):
-            new_node = InternalNode(op_name=root.op, left=None, right=None, which=root.which)
-        elif isinstance(root, TerminalNode):
-            new_node = TerminalNode(type_str=root.type_str, index=root.index, which=root.which)
-        else:
-            raise TypeError("Unknown node type")
-        
-        current_idx += 1
-        
-        if root.left:
-            if current_idx <= target_idx:
-                size_left = GeneticOperator._count_nodes(root.left)
-                if target_idx < current_idx + size_left:
-                    new_left, new_idx = GeneticOperator._replace_node_at_index(root.left, target_idx, new_subtree, current_idx)
-                    new_node.left = new_left
-                    new_node.right = root.right.copy() if root.right else None
-                    return new_node, new_idx
-
-                else:
-                    new_node.left = root.left.copy()
-                    current_idx += size_left
-                
-        if root.right:
-            new_right, new_idx = GeneticOperator._replace_node_at_index(root.right, target_idx, new_subtree, current_idx)
-            new_node.right = new_right
-            return new_node, new_idx
-        
-        return new_node, current_idx 
-
+    def _select_crossover_points(
+            tree1: LinearTree, 
+            tree2: LinearTree, 
+            max_depth: int
+        ) -> Optional[tuple[int, int]]:
+        """
+        Chọn ngẫu nhiên (đều) một cặp điểm cắt hợp lệ: sau khi hoán đổi, cây con ghép vào node có
+        độ sâu l và chiều cao h thỏa l + h - 1 <= max_depth ở cả hai cây. None nếu không có cặp nào.
+        """
+        levels1, heights1 = tree1.levels, tree1.heights
+        levels2, heights2 = tree2.levels, tree2.heights
+        
+        # counts[l][h]: số node của tree2 có độ sâu <= l và chiều cao <= h (tổng tiền tố 2 chiều)
+        dim = max_depth + 1
+        counts = [[0] * dim for _ in range(dim)]
+        for lv, h in zip(levels2, heights2):
+            if lv < dim and h < dim:
+                counts[lv][h] += 1
+        for lv in range(1, dim):
+            row, prev = counts[lv], counts[lv - 1]
+            for h in range(1, dim):
+                row[h] += row[h - 1] + prev[h] - prev[h - 1]
+        
+        # Trọng số của mỗi điểm cắt trên tree1 = số điểm cắt tương thích trên tree2
+        weights = []
+        for lv, h in zip(levels1, heights1):
+            max_level2 = max_depth - h + 1
+            max_height2 = max_depth - lv + 1
+            weights.append(counts[max_level2][max_height2] if max_level2 >= 1 and max_height2 >= 1 else 0)
+        if not any(weights):
+            return None
+        
+        idx1 = random.choices(range(len(weights)), weights=weights)[0]
+        level1, height1 = levels1[idx1], heights1[idx1]
+        candidates = [
+            j for j, (lv, h) in enumerate(zip(levels2, heights2))
+            if lv + height1 - 1 <= max_depth and level1 + h - 1 <= max_depth
+        ]
+        return idx1, random.choice(candidates)
 
     # -----------------------
     # Genetic Operators
     # -----------------------
+    # Mỗi phép biến đổi trả về (LinearTree mới, NodeGP mới hoặc None). Nếu cây cha đã được dựng thành NodeGP,
+    # NodeGP mới được tạo bằng path copying nên dùng chung mọi cây con không bị đụng tới với cha mẹ.
     @staticmethod
     def perform_crossover(
             parent1: Individual, 
@@ -99,115 +66,113 @@ class GeneticOperator:
         child2 = parent2.copy()
         
         # Chọn lai cây R hay lai cây S
-        if random.random() < 0.5:
-            tree1 = child1.r_tree
-            tree2 = child2.r_tree
-            which = 'R'
-        else:
-            tree1 = child1.s_tree
-            tree2 = child2.s_tree
-            which = 'S'
-            
-        # Đếm số node
-        size1 = GeneticOperator._count_nodes(tree1)
-        size2 = GeneticOperator._count_nodes(tree2)
-        
-        for _ in range(10):
-            idx1 = random.randint(0, size1-1)
-            idx2 = random.randint(0, size2-1)
-            
-            # Lấy subtree tại điểm cắt
-            subtree1,_ = GeneticOperator._get_node_at_index(tree1, idx1)
-            subtree2,_ = GeneticOperator._get_node_at_index(tree2, idx2)
-            
-            # Kiểm tra deep limit
-            if (tree1.depth() - subtree1.depth() + subtree2.depth() <= max_depth) and \
-                (tree2.depth() - subtree2.depth() + subtree1.depth() <= max_depth):
-                
-                # Thực hiện hoán đổi bằng cách xây dựng lại hai cây
-                if which == 'R':
-                    child1.r_tree, _ = GeneticOperator._replace_node_at_index(child1.r_tree, idx1, subtree2)
-                    child2.r_tree, _ = GeneticOperator._replace_node_at_index(child2.r_tree, idx2, subtree1)
-                else:
-                    child1.s_tree, _ = GeneticOperator._replace_node_at_index(child1.s_tree, idx1, subtree2)
-                    child2.s_tree, _ = GeneticOperator._replace_node_at_index(child2.s_tree, idx2, subtree1)
-                
-                break
+        which = 'R' if random.random() < 0.5 else 'S'
+        tree1 = child1.linear(which)
+        tree2 = child2.linear(which)
+        
+        # Chọn thẳng một cặp điểm cắt thỏa deep limit thay vì thử ngẫu nhiên
+        points = GeneticOperator._select_crossover_points(tree1, tree2, max_depth)
+        if points is None:
+            return child1, child2
+        idx1, idx2 = points
+        subtree1 = tree1.subtree(idx1)
+        subtree2 = tree2.subtree(idx2)
+        
+        # Hoán đổi cây con trên NodeGP (nếu cả hai đã được dựng), dùng chung phần còn lại của cha mẹ
+        root1 = child1.cached_node(which)
+        root2 = child2.cached_node(which)
+        node1 = node2 = None
+        if root1 is not None and root2 is not None:
+            sub_node1 = tree1.node_at(root1, idx1)
+            sub_node2 = tree2.node_at(root2, idx2)
+            node1 = tree1.replace_node(root1, idx1, sub_node2)
+            node2 = tree2.replace_node(root2, idx2, sub_node1)
+        
+        # Thực hiện hoán đổi bằng cách ghép lại hai mảng
+        child1.set_tree(which, tree1.replace(idx1, subtree2), node1)
+        child2.set_tree(which, tree2.replace(idx2, subtree1), node2)
         return child1, child2
 
     @staticmethod
-    def _mutation_subtree(target_tree: NodeGP, max_depth: int, which: str) -> Optional[NodeGP]:
+    def _mutation_subtree(
+            target_tree: LinearTree, 
+            root: Optional[NodeGP], 
+            max_depth: int, 
+            which: str
+        ) -> Optional[tuple[LinearTree, Optional[NodeGP]]]:
         """Đột biến thay thế cả cây con bằng cây ngẫu nhiên mới (Standard)"""
-        size = GeneticOperator._count_nodes(target_tree)
+        size = target_tree.size()
         idx = random.randint(0, size - 1)
         
         # Tạo cây con mới nhỏ (depth 1-3) để ghép vào
         mutation_subtree = PopulationInitializer.make_random_tree(max_depth=random.randint(1, 3), grow=True, which=which)
-        new_tree, _ = GeneticOperator._replace_node_at_index(target_tree, idx, mutation_subtree)
+        new_tree = target_tree.replace(idx, LinearTree.from_node(mutation_subtree))
         
         if new_tree.depth() <= max_depth:
-            return new_tree
+            new_root = target_tree.replace_node(root, idx, mutation_subtree) if root is not None else None
+            return new_tree, new_root
         return None
 
     @staticmethod
-    def _mutation_point(target_tree: NodeGP, which: str) -> Optional[NodeGP]:
+    def _mutation_point(
+            target_tree: LinearTree, 
+            root: Optional[NodeGP], 
+            which: str
+        ) -> Optional[tuple[LinearTree, Optional[NodeGP]]]:
         """Đột biến điểm: Thay đổi toán tử hoặc giá trị terminal giữ nguyên cấu trúc"""
-        new_tree = target_tree.copy()
-        size = GeneticOperator._count_nodes(new_tree)
+        size = target_tree.size()
         idx = random.randint(0, size - 1)
+        old_node = target_tree.node_at(root, idx) if root is not None else None
         
-        node_to_mod, _ = GeneticOperator._get_node_at_index(new_tree, idx)
-        
-        if isinstance(node_to_mod, InternalNode):
+        if target_tree.is_internal(idx):
             # Thay đổi toán tử (ví dụ: add -> sub)
-            current_op = node_to_mod.op
+            current_op = target_tree.op_at(idx)
             candidates = [op for op in FUNC_SET if op != current_op]
-            if candidates:
-                node_to_mod._op_name = random.choice(candidates)
-                node_to_mod._func = from_string_to_func(node_to_mod._op_name)
-                
-                new_internal = InternalNode(random.choice(candidates), node_to_mod.left, node_to_mod.right, which=which)
-                final_tree, _ = GeneticOperator._replace_node_at_index(new_tree, idx, new_internal)
-                return final_tree
-                
-        elif isinstance(node_to_mod, TerminalNode):
+            new_op = random.choice(candidates)
+            new_node = InternalNode(new_op, old_node.left, old_node.right, which) if old_node is not None else None
+            new_code = OP_CODES[new_op]
+        else:
             # Thay đổi index của terminal (ví dụ: RT1 -> RT3)
-            current_idx = node_to_mod.index
+            current_idx = target_tree.terminal_index_at(idx)
             new_val = random.choice([i for i in range(6) if i != current_idx])
-            
-            new_term = TerminalNode(node_to_mod.type_str, new_val, which=which)
-            final_tree, _ = GeneticOperator._replace_node_at_index(new_tree, idx, new_term)
-            return final_tree
-            
-        return new_tree
+            new_node = TerminalNode(old_node.type_str, new_val, which) if old_node is not None else None
+            new_code = N_OPS + new_val
+        
+        new_root = target_tree.replace_node(root, idx, new_node) if new_node is not None else None
+        return target_tree.with_code(idx, new_code), new_root
 
     @staticmethod
-    def _mutation_hoist(target_tree: NodeGP) -> Optional[NodeGP]:
+    def _mutation_hoist(
+            target_tree: LinearTree, 
+            root: Optional[NodeGP]
+        ) -> Optional[tuple[LinearTree, Optional[NodeGP]]]:
         """Đột biến nâng: Chọn 1 cây con và biến nó thành cây gốc mới (giảm size)"""
-        size = GeneticOperator._count_nodes(target_tree)
+        size = target_tree.size()
         if size < 2: return None # Không thể hoist nếu chỉ có 1 node
         
-        # Chọn node bất kỳ
+        # Chọn node bất kỳ, cây con của nó làm cây mới
         idx = random.randint(0, size - 1)
-        subtree, _ = GeneticOperator._get_node_at_index(target_tree, idx)
-        
-        # Trả về bản copy của subtree đó làm cây mới
-        return subtree.copy()
+        new_root = target_tree.node_at(root, idx) if root is not None else None
+        return target_tree.subtree(idx), new_root
 
     @staticmethod
-    def _mutation_permutation(target_tree: NodeGP) -> Optional[NodeGP]:
+    def _mutation_permutation(
+            target_tree: LinearTree, 
+            root: Optional[NodeGP]
+        ) -> Optional[tuple[LinearTree, Optional[NodeGP]]]:
         """Đột biến hoán vị: Đổi chỗ con trái/phải của 1 node toán tử"""
-        new_tree = target_tree.copy()
-        size = GeneticOperator._count_nodes(new_tree)
+        size = target_tree.size()
         
         # Thử tìm internal node 5 lần, nếu toàn vớ phải lá thì thôi
         for _ in range(5):
             idx = random.randint(0, size - 1)
-            node, _ = GeneticOperator._get_node_at_index(new_tree, idx)
-            if isinstance(node, InternalNode):
-                # Swap left and right
-                node.left, node.right = node.right, node.left
-                return new_tree
+            if target_tree.is_internal(idx):
+                new_root = None
+                if root is not None:
+                    old_node = target_tree.node_at(root, idx)
+                    swapped = InternalNode(old_node.op, old_node.right, old_node.left, old_node.which)
+                    new_root = target_tree.replace_node(root, idx, swapped)
+                return target_tree.swap_children(idx), new_root
                 
         return None # Không tìm thấy node nội bộ phù hợp để swap
     
@@ -226,35 +191,29 @@ class GeneticOperator:
         new_indi = indi.copy()
         
         # Chọn R hoặc S để đột biến
-        if random.random() < 0.5:
-            target_tree = new_indi.r_tree
-            which = 'R'
-        else:
-            target_tree = new_indi.s_tree
-            which = 'S'
+        which = 'R' if random.random() < 0.5 else 'S'
+        target_tree = new_indi.linear(which)
+        root = new_indi.cached_node(which)
         
         r = random.random()
-        mutated_tree = None
+        mutated = None
 
         # Logic chọn loại đột biến
         if r < 0.6:
             # 60% Subtree Mutation
-            mutated_tree = GeneticOperator._mutation_subtree(target_tree, max_depth, which)
+            mutated = GeneticOperator._mutation_subtree(target_tree, root, max_depth, which)
         elif r < 0.8:
             # 20% Point Mutation (Tinh chỉnh nhỏ)
-            mutated_tree = GeneticOperator._mutation_point(target_tree, which)
+            mutated = GeneticOperator._mutation_point(target_tree, root, which)
         elif r < 0.9:
              # 10% Hoist Mutation (Chống bloat, giảm depth)
-             mutated_tree = GeneticOperator._mutation_hoist(target_tree)
+             mutated = GeneticOperator._mutation_hoist(target_tree, root)
         else:
              # 10% Permutation (Đổi vai trò tham số)
-             mutated_tree = GeneticOperator._mutation_permutation(target_tree)
+             mutated = GeneticOperator._mutation_permutation(target_tree, root)
         
         # Nếu đột biến thành công và thỏa mãn depth, cập nhật
-        if mutated_tree is not None and mutated_tree.depth() <= max_depth:
-            if which == 'R':
-                new_indi.r_tree = mutated_tree
-            else:
-                new_indi.s_tree = mutated_tree
+        if mutated is not None and mutated[0].depth() <= max_depth:
+            new_indi.set_tree(which, *mutated)
                 
-        return new_indi
\ No newline at end of file
+        return new_indi
@@ -1,5 +1,6 @@
 from __future__ import annotations
 import math
+import numpy as np
 from abc import ABC, abstractmethod
 from typing import Literal, Optional, Callable, Dict, Tuple, Any
 from .problem_structures import Vehicle, Problem, Request
@@ -16,6 +17,18 @@ OPERATORS: Dict[str, Callable[[float, float], float]] = {
     'min': min,
     'max': max
 }
+# Các toán tử giao hoán: dạng chuẩn (canonical) sắp xếp hai con theo thứ tự cố định
+COMMUTATIVE_OPS = {'add', 'mul', 'min', 'max'}
+# Mã số nguyên của node trong LinearTree: toán tử là vị trí trong FUNC_SET, terminal index i là N_OPS + i
+N_OPS = len(FUNC_SET)
+OP_CODES: Dict[str, int] = {op: code for code, op in enumerate(FUNC_SET)}
+
+# Terminal phụ thuộc vào tập request đã xuất hiện (số lượng / tổng demand), không chỉ vào xe và request
+ARRIVAL_DEPENDENT_TERMINALS = {('RT', 0), ('RT', 1), ('RT', 4), ('ST', 3)}
+# Terminal phụ thuộc trực tiếp vào thời điểm hiện tại (curr_time)
+TIME_DEPENDENT_TERMINALS = {('ST', 1), ('ST', 4)}
+# Terminal phụ thuộc vào trạng thái của xe đang xét (vị trí, hàng đợi, busy_until, loại xe)
+VEHICLE_DEPENDENT_TERMINALS = {('RT', 0), ('RT', 1), ('RT', 2), ('RT', 3), ('RT', 5), ('ST', 0), ('ST', 2)}
 
 
 class TerminalRegistry:
@@ -42,7 +55,7 @@ class TerminalRegistry:
         
         # RT3: Thời gian di chuyển ngắn nhất từ vị trí hiện tại - w=0.5
         elif opt == 3:
-            return 1.0 - veh.moving_time_to(req.location) / pro.depot_time_window[1]
+            return 1.0 - veh.travel_time_to(req.id) / pro.depot_time_window[1]
         
         # RT4: demand của request càng lớn càng được ưu tiên - w=0.05
         elif opt == 4:
@@ -61,7 +74,7 @@ class TerminalRegistry:
         
         # ST0: thời gian di chuyển đến càng ngắn thì càng được ưu tiên - w=0.4
         if opt == 0:
-            return veh.moving_time_to(req.location) / pro.depot_time_window[1]
+            return veh.travel_time_to(req.id) / pro.depot_time_window[1]
         
         # ST1: càng xuất hiện sớm (so với hiện tại) thì càng ưu tiên - w=0.05
         elif opt == 1:
@@ -73,7 +86,7 @@ class TerminalRegistry:
         # ST2: càng gấp càng ưu tiên - w=0.4
         elif opt == 2:
             time_until_close = req.time_window[1] - veh.busy_until
-            moving_time = veh.moving_time_to(req.location)
+            moving_time = veh.travel_time_to(req.id)
             if moving_time > time_until_close or time_until_close <= 1e-3:
                 return 1e9
             # return moving_time / time_until_close
@@ -97,6 +110,7 @@ class TerminalRegistry:
 
 class NodeGP(ABC):
     """ABC cho tất cả các node trong cây GP."""
+    __slots__ = ('which', 'left', 'right')
     
     def __init__(self, which: Literal['S', 'R'] = 'R'):
         self.which = which
@@ -122,6 +136,16 @@ class NodeGP(ABC):
     @abstractmethod
     def to_string(self) -> str:
         pass
+
+    @abstractmethod
+    def terminals(self) -> set[Tuple[str, int]]:
+        """Tập các terminal (type_str, index) xuất hiện trong cây."""
+        pass
+
+    @abstractmethod
+    def to_canonical_string(self) -> str:
+        """Chuỗi dạng chuẩn: hai cây chỉ khác thứ tự con của toán tử giao hoán có cùng chuỗi."""
+        pass
     
     @property
     @abstractmethod
@@ -138,6 +162,7 @@ class NodeGP(ABC):
 
 class InternalNode(NodeGP):
     """Node trong chứa operator"""
+    __slots__ = ('_op_name', '_func')
     
     def __init__(self, op_name: str, left: NodeGP, right: NodeGP, which: Literal['S', 'R'] = 'R'):
         super().__init__(which)
@@ -165,6 +190,16 @@ class InternalNode(NodeGP):
     def to_string(self) -> str:
         return f"({self._op_name} {self.left.to_string()} {self.right.to_string()})"
 
+    def terminals(self) -> set[Tuple[str, int]]:
+        return self.left.terminals() | self.right.terminals()
+
+    def to_canonical_string(self) -> str:
+        left = self.left.to_canonical_string()
+        right = self.right.to_canonical_string()
+        if self._op_name in COMMUTATIVE_OPS and right < left:
+            left, right = right, left
+        return f"({self._op_name} {left} {right})"
+
     @property
     def op(self) -> str:
         return self._op_name
@@ -176,6 +211,7 @@ class InternalNode(NodeGP):
 
 class TerminalNode(NodeGP):
     """Node lá chứa logic terminal"""
+    __slots__ = ('type_str', 'index')
     
     def __init__(self, type_str: str, index: int, which: Literal['S', 'R'] = 'R'):
         super().__init__(which)
@@ -203,6 +239,12 @@ class TerminalNode(NodeGP):
 
     def to_string(self) -> str:
         return f"{self.type_str}{self.index}"
+
+    def terminals(self) -> set[Tuple[str, int]]:
+        return {(self.type_str, self.index)}
+
+    def to_canonical_string(self) -> str:
+        return self.to_string()
     
     @property
     def op(self) -> None:
@@ -213,6 +255,612 @@ class TerminalNode(NodeGP):
         return (self.type_str, self.index)
 
 
+class ConstantNode(NodeGP):
+    """
+    Node lá hằng số. Chỉ xuất hiện trong cây đã rút gọn bởi TreeSimplifier (cây dùng để đánh giá),
+    không thuộc bộ mã hóa của cá thể nên không có trong LinearTree.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value: float, which: Literal['S', 'R'] = 'R'):
+        super().__init__(which)
+        self.value = value
+
+    def evaluate(self, veh: Vehicle, pro: Problem, req: Request, curr_time: float = 0.0) -> float:
+        return self.value
+
+    def copy(self) -> ConstantNode:
+        return ConstantNode(self.value, self.which)
+
+    def size(self) -> int:
+        return 1
+
+    def depth(self) -> int:
+        return 1
+
+    def to_string(self) -> str:
+        return repr(self.value)
+
+    def terminals(self) -> set[Tuple[str, int]]:
+        return set()
+
+    def to_canonical_string(self) -> str:
+        return self.to_string()
+
+    @property
+    def op(self) -> None:
+        return None
+
+    @property
+    def terminal(self) -> None:
+        return None
+
+
+class LinearTree:
+    """
+    Cây GP mã hóa tuyến tính theo thứ tự tiền tự (pre-order) trong một mảng byte bất biến.
+    Mã < N_OPS là toán tử FUNC_SET[code] (hai con theo sau), mã >= N_OPS là terminal index code - N_OPS;
+    loại terminal (RT/ST) suy ra từ which. Cây con tại vị trí i là đoạn codes[i:subtree_end(i)],
+    nên copy, size, lấy và thay cây con đều là thao tác slice. NodeGP chỉ còn là giao diện tương thích.
+    Với mỗi node, vị trí kết thúc cây con (ends), chiều cao cây con (heights) và độ sâu tính từ gốc
+    (levels, gốc = 1) được tính một lần trong O(n) ở lần truy vấn đầu tiên rồi giữ lại cùng cây.
+    """
+    __slots__ = ('codes', 'which', '_ends', '_heights', '_levels')
+
+    def __init__(self, codes: bytes, which: Literal['S', 'R'] = 'R'):
+        self.codes = codes
+        self.which = which
+        self._ends: Optional[list[int]] = None
+        self._heights: Optional[list[int]] = None
+        self._levels: Optional[list[int]] = None
+
+    @staticmethod
+    def from_node(root: NodeGP) -> LinearTree:
+        type_str = 'RT' if root.which == 'R' else 'ST'
+        codes = bytearray()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, TerminalNode):
+                if node.type_str != type_str or not 0 <= node.index < 256 - N_OPS:
+                    raise ValueError(f"Cannot encode terminal {node.to_string()} in {root.which}-tree")
+                codes.append(N_OPS + node.index)
+            else:
+                codes.append(OP_CODES[node.op])
+                stack.append(node.right)
+                stack.append(node.left)
+        return LinearTree(bytes(codes), root.which)
+
+    def to_node(self) -> NodeGP:
+        """Dựng lại cây NodeGP tương ứng (duyệt ngược mảng tiền tự bằng stack)."""
+        type_str = 'RT' if self.which == 'R' else 'ST'
+        stack: list[NodeGP] = []
+        for code in reversed(self.codes):
+            if code < N_OPS:
+                left = stack.pop()
+                right = stack.pop()
+                stack.append(InternalNode(FUNC_SET[code], left, right, self.which))
+            else:
+                stack.append(TerminalNode(type_str, code - N_OPS, self.which))
+        return stack[0]
+
+    def copy(self) -> LinearTree:
+        # Mảng byte bất biến, không cần sao chép dữ liệu
+        new_tree = LinearTree(self.codes, self.which)
+        new_tree._ends, new_tree._heights, new_tree._levels = self._ends, self._heights, self._levels
+        return new_tree
+
+    def size(self) -> int:
+        return len(self.codes)
+
+    def _build_index(self) -> None:
+        codes = self.codes
+        n = len(codes)
+        ends = [0] * n
+        heights = [0] * n
+        stack: list[int] = []  # chỉ số gốc của các cây con đã duyệt (duyệt ngược nên con trái ở đỉnh)
+        for i in range(n - 1, -1, -1):
+            if codes[i] < N_OPS:
+                left = stack.pop()
+                right = stack.pop()
+                ends[i] = ends[right]
+                heights[i] = 1 + (heights[left] if heights[left] > heights[right] else heights[right])
+            else:
+                ends[i] = i + 1
+                heights[i] = 1
+            stack.append(i)
+        levels = [1] * n
+        for i in range(n):
+            if codes[i] < N_OPS:
+                child_level = levels[i] + 1
+                levels[i + 1] = child_level
+                levels[ends[i + 1]] = child_level
+        self._ends = ends
+        self._heights = heights
+        self._levels = levels
+
+    @property
+    def ends(self) -> list[int]:
+        """ends[i]: vị trí ngay sau cây con bắt đầu tại i (offset pre-order)."""
+        if self._ends is None:
+            self._build_index()
+        return self._ends
+
+    @property
+    def heights(self) -> list[int]:
+        """heights[i]: chiều cao (depth) của cây con tại i."""
+        if self._heights is None:
+            self._build_index()
+        return self._heights
+
+    @property
+    def levels(self) -> list[int]:
+        """levels[i]: độ sâu của node i tính từ gốc (gốc = 1)."""
+        if self._levels is None:
+            self._build_index()
+        return self._levels
+
+    def depth(self) -> int:
+        return self.heights[0]
+
+    def is_internal(self, idx: int) -> bool:
+        return self.codes[idx] < N_OPS
+
+    def op_at(self, idx: int) -> Optional[str]:
+        code = self.codes[idx]
+        return FUNC_SET[code] if code < N_OPS else None
+
+    def terminal_index_at(self, idx: int) -> Optional[int]:
+        code = self.codes[idx]
+        return code - N_OPS if code >= N_OPS else None
+
+    def subtree_end(self, idx: int) -> int:
+        """Vị trí ngay sau cây con bắt đầu tại idx."""
+        return self.ends[idx]
+
+    def subtree(self, idx: int) -> LinearTree:
+        end = self.subtree_end(idx)
+        sub = LinearTree(self.codes[idx:end], self.which)
+        # Metadata của cây con lấy thẳng từ cây cha, chỉ dịch offset
+        sub._ends = [e - idx for e in self._ends[idx:end]]
+        sub._heights = self._heights[idx:end]
+        offset = self._levels[idx] - 1
+        sub._levels = [lv - offset for lv in self._levels[idx:end]]
+        return sub
+
+    def replace(self, idx: int, subtree: LinearTree) -> LinearTree:
+        """Cây mới với cây con tại idx được thay bằng subtree."""
+        codes = self.codes
+        return LinearTree(codes[:idx] + subtree.codes + codes[self.subtree_end(idx):], self.which)
+
+    def node_at(self, root: NodeGP, idx: int) -> NodeGP:
+        """Node của root (NodeGP tương ứng với cây này) ở vị trí pre-order idx, đi theo ends trong O(depth)."""
+        ends = self.ends
+        node, pos = root, 0
+        while pos != idx:
+            left_end = ends[pos + 1]
+            if idx < left_end:
+                node, pos = node.left, pos + 1
+            else:
+                node, pos = node.right, left_end
+        return node
+
+    def replace_node(self, root: NodeGP, idx: int, subtree: NodeGP) -> NodeGP:
+        """
+        NodeGP của replace(idx, ...) dựng từ root (NodeGP tương ứng với cây này) bằng path copying:
+        chỉ các node trên đường từ gốc tới idx được tạo mới, mọi cây con khác (và subtree) dùng chung tham chiếu.
+        """
+        ends = self.ends
+        path: list[Tuple[NodeGP, bool]] = []  # (node cha, đi sang con trái?)
+        node, pos = root, 0
+        while pos != idx:
+            left_end = ends[pos + 1]
+            go_left = idx < left_end
+            path.append((node, go_left))
+            if go_left:
+                node, pos = node.left, pos + 1
+            else:
+                node, pos = node.right, left_end
+        new_node = subtree
+        for parent, go_left in reversed(path):
+            if go_left:
+                new_node = InternalNode(parent.op, new_node, parent.right, parent.which)
+            else:
+                new_node = InternalNode(parent.op, parent.left, new_node, parent.which)
+        return new_node
+
+    def with_code(self, idx: int, code: int) -> LinearTree:
+        """Cây mới với node tại idx đổi mã (cùng số con)."""
+        codes = self.codes
+        return LinearTree(codes[:idx] + bytes((code,)) + codes[idx + 1:], self.which)
+
+    def swap_children(self, idx: int) -> LinearTree:
+        """Cây mới với hai cây con của toán tử tại idx được đổi chỗ."""
+        codes = self.codes
+        left_end = self.subtree_end(idx + 1)
+        right_end = self.subtree_end(left_end)
+        return LinearTree(
+            codes[:idx + 1] + codes[left_end:right_end] + codes[idx + 1:left_end] + codes[right_end:],
+            self.which
+        )
+
+    def terminals(self) -> set[Tuple[str, int]]:
+        type_str = 'RT' if self.which == 'R' else 'ST'
+        return {(type_str, code - N_OPS) for code in set(self.codes) if code >= N_OPS}
+
+    def to_string(self) -> str:
+        return self.to_node().to_string()
+
+
+class SubtreeInterner:
+    """
+    Hash-consing cây GP: các cây con giống hệt nhau (cùng toán tử, cùng các con đã intern, cùng terminal/hằng số)
+    được thay bằng một node dùng chung, nên cây của cả quần thể tạo thành một DAG. Khóa của node trong
+    dùng id của các con đã intern nên mỗi node tốn O(1). Khi bảng vượt max_size thì xóa và bắt đầu lại
+    (các DAG đã tạo vẫn hợp lệ, chỉ không còn dùng chung với cây intern sau đó).
+    """
+
+    def __init__(self, max_size: int = 200000):
+        self.max_size = max_size
+        self._table: Dict[Tuple[Any, ...], NodeGP] = {}
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def clear(self) -> None:
+        self._table.clear()
+
+    def intern(self, root: NodeGP) -> NodeGP:
+        if len(self._table) >= self.max_size:
+            self._table.clear()
+        return self._intern(root)
+
+    def _intern(self, node: NodeGP) -> NodeGP:
+        if isinstance(node, InternalNode):
+            left = self._intern(node.left)
+            right = self._intern(node.right)
+            key: Tuple[Any, ...] = (node.op, node.which, id(left), id(right))
+        elif isinstance(node, ConstantNode):
+            left = right = None
+            key = ('const', node.which, repr(node.value))
+        else:
+            left = right = None
+            key = ('term', node.which, node.terminal)
+        shared = self._table.get(key)
+        if shared is None:
+            if isinstance(node, InternalNode) and (left is not node.left or right is not node.right):
+                node = InternalNode(node.op, left, right, node.which)
+            self._table[key] = shared = node
+        return shared
+
+
+# Bảng intern dùng chung cho cây đánh giá của mọi cá thể trong tiến trình.
+# NSGA2Optimizer.evolve xóa bảng khi bắt đầu và kết thúc, nên cây không bị giữ lại giữa các lần chạy / problem.
+SUBTREE_INTERNER = SubtreeInterner()
+
+
+class TreeCompiler:
+    """
+    Dịch cây GP thành một hàm Python phẳng f(veh, pro, req, curr_time) -> float.
+    Toán tử và biểu thức của terminal được inline (không đệ quy, không qua TerminalRegistry),
+    kết quả giống hệt NodeGP.evaluate.
+    Mỗi terminal và mỗi node dùng chung (DAG từ SubtreeInterner) chỉ được tính một lần trong một lần gọi,
+    các lần xuất hiện sau dùng lại biến đã tính.
+    """
+    # Các giá trị dùng chung, chỉ tính khi cây thực sự cần tới
+    _PRELUDE: Dict[str, str] = {
+        'close': "close = pro.depot_time_window[1]",
+        'tt': "tt = veh.travel_times[veh.current_loc_idx][req.id]",
+        'sd': "sd = pro.sum_of_req_demand()",
+    }
+
+    # Mỗi terminal: (các giá trị cần trong prelude, các dòng code gán kết quả cho {out})
+    _TERMINALS: Dict[Tuple[str, int], Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+        ('RT', 0): ((), (
+            "{out} = 0.0 if not pro.requests else 1.0 - len(veh.req_queue) / len(pro.requests)",
+        )),
+        ('RT', 1): (('sd',), (
+            "{out} = 0.0 if sd == 0.0 else (veh.capacity - veh.sum_of_req_demand()) / sd",
+        )),
+        ('RT', 2): (('close',), (
+            "{out} = 1.0 - veh.moving_time(veh.median_of_req_loc(), req.location) / close",
+        )),
+        ('RT', 3): (('close', 'tt'), (
+            "{out} = 1.0 - tt / close",
+        )),
+        ('RT', 4): (('sd',), (
+            "{out} = 0.0 if sd == 0.0 else req.demand / sd",
+        )),
+        ('RT', 5): ((), (
+            "{out} = 1.0 if veh.type == 'DRONE' else 0.0",
+        )),
+        ('ST', 0): (('close', 'tt'), (
+            "{out} = tt / close",
+        )),
+        ('ST', 1): (('close',), (
+            "{out} = 1.0 - (curr_time - req.release_time) / close",
+        )),
+        ('ST', 2): (('tt',), (
+            "{out} = req.time_window[1] - veh.busy_until",
+            "if tt > {out} or {out} <= 1e-3:",
+            "    {out} = 1e9",
+            "else:",
+            "    {out} = max(0.0, ({out} - tt) / {out})",
+        )),
+        ('ST', 3): (('sd',), (
+            "{out} = 0.0 if sd == 0.0 else 1.0 - req.demand / sd",
+        )),
+        ('ST', 4): (('close',), (
+            "{out} = 1.0 - (curr_time - req.time_window[0]) / close",
+        )),
+        ('ST', 5): (('close',), (
+            "{out} = req.release_time / close",
+        )),
+    }
+
+    # min/max viết lại đúng ngữ nghĩa của builtin min(a, b)/max(a, b)
+    _OPERATORS: Dict[str, str] = {
+        'add': "{out} = {a} + {b}",
+        'sub': "{out} = {a} - {b}",
+        'mul': "{out} = {a} * {b}",
+        'div': "{out} = {a} / {b} if {b} != 0 else 1.0",
+        'min': "{out} = {b} if {b} < {a} else {a}",
+        'max': "{out} = {b} if {b} > {a} else {a}",
+    }
+
+    @staticmethod
+    def generate_source(root: NodeGP, func_name: str = '_gp_tree') -> str:
+        """Sinh mã nguồn của hàm tương ứng với cây (hữu ích để debug)."""
+        body: list[str] = []
+        needed: set[str] = set()
+        counter = [0]
+        memo: Dict[Any, str] = {}  # terminal / id(node) -> biến đã giữ giá trị
+
+        def emit(node: NodeGP) -> str:
+            key = node.terminal if isinstance(node, TerminalNode) else id(node)
+            if key in memo:
+                return memo[key]
+            memo[key] = out = emit_node(node)
+            return out
+
+        def emit_node(node: NodeGP) -> str:
+            out = f"v{counter[0]}"
+            counter[0] += 1
+            if isinstance(node, ConstantNode):
+                body.append(f"{out} = {node.value!r}")
+                return out
+            if isinstance(node, TerminalNode):
+                spec = TreeCompiler._TERMINALS.get(node.terminal)
+                if node.type_str not in ('RT', 'ST'):
+                    body.append(f"{out} = 0.0")
+                elif spec is None:
+                    # Giữ nguyên hành vi (ValueError) của TerminalRegistry với terminal không hợp lệ
+                    logic = 'rt_logic' if node.type_str == 'RT' else 'st_logic'
+                    extra = '' if node.type_str == 'RT' else ', curr_time'
+                    body.append(f"{out} = TerminalRegistry.{logic}({node.index}, veh, pro, req{extra})")
+                else:
+                    deps, lines = spec
+                    needed.update(deps)
+                    body.extend(line.format(out=out) for line in lines)
+                return out
+            a = emit(node.left)
+            b = emit(node.right)
+            body.append(TreeCompiler._OPERATORS[node.op].format(out=out, a=a, b=b))
+            return out
+
+        result = emit(root)
+        prelude = [TreeCompiler._PRELUDE[k] for k in ('close', 'tt', 'sd') if k in needed]
+        lines = [f"def {func_name}(veh, pro, req, curr_time=0.0):"]
+        lines.extend("    " + line for line in prelude + body)
+        lines.append(f"    return {result}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def compile(root: NodeGP, func_name: str = '_gp_tree') -> Callable[[Vehicle, Problem, Request, float], float]:
+        source = TreeCompiler.generate_source(root, func_name)
+        namespace: Dict[str, Any] = {'TerminalRegistry': TerminalRegistry}
+        exec(compile(source, f"<gp:{func_name}>", 'exec'), namespace)
+        return namespace[func_name]
+
+    # -------------------------
+    # Phiên bản batch: đánh giá cây trên mảng NumPy, mỗi phần tử là một ứng viên
+    # -------------------------
+    # R-tree: f(feat, vehicles, pro, req) -> một giá trị cho mỗi xe trong vehicles,
+    #         feat gồm 'tt' (thời gian di chuyển tới req), 'capacity', 'is_drone' của các xe đó.
+    # S-tree: f(feat, veh, pro, curr_time) -> một giá trị cho mỗi request trong hàng đợi của veh,
+    #         feat gồm 'tt' (thời gian veh di chuyển tới request), 'tw0', 'tw1', 'release', 'demand'.
+    _BATCH_PRELUDE: Dict[str, str] = {
+        'close': "close = pro.depot_time_window[1]",
+        'sd': "sd = pro.sum_of_req_demand()",
+        'tt': "tt = feat['tt']",
+        'cap': "cap = feat['capacity']",
+        'drone': "drone = feat['is_drone']",
+        'qlen': "qlen = np.array([len(v.req_queue) for v in vehicles], dtype=float)",
+        'qdem': "qdem = np.array([v.sum_of_req_demand() for v in vehicles])",
+        'tw0': "tw0 = feat['tw0']",
+        'tw1': "tw1 = feat['tw1']",
+        'release': "release = feat['release']",
+        'demand': "demand = feat['demand']",
+    }
+
+    _BATCH_TERMINALS: Dict[Tuple[str, int], Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+        ('RT', 0): (('qlen',), (
+            "{out} = 1.0 - qlen / len(pro.requests) if pro.requests else np.zeros(n)",
+        )),
+        ('RT', 1): (('sd', 'cap', 'qdem'), (
+            "{out} = np.zeros(n) if sd == 0.0 else (cap - qdem) / sd",
+        )),
+        # Tính từng xe bằng đúng công thức vô hướng (x**2 của Python không phải lúc nào cũng bằng x*x của NumPy)
+        ('RT', 2): (('close',), (
+            "{out} = 1.0 - np.array([v.moving_time(v.median_of_req_loc(), req.location) for v in vehicles]) / close",
+        )),
+        ('RT', 3): (('close', 'tt'), (
+            "{out} = 1.0 - tt / close",
+        )),
+        ('RT', 4): (('sd',), (
+            "{out} = np.full(n, 0.0 if sd == 0.0 else req.demand / sd)",
+        )),
+        ('RT', 5): (('drone',), (
+            "{out} = np.where(drone, 1.0, 0.0)",
+        )),
+        ('ST', 0): (('close', 'tt'), (
+            "{out} = tt / close",
+        )),
+        ('ST', 1): (('close', 'release'), (
+            "{out} = 1.0 - (curr_time - release) / close",
+        )),
+        ('ST', 2): (('tt', 'tw1'), (
+            "{out} = tw1 - veh.busy_until",
+            "{out} = np.where((tt > {out}) | ({out} <= 1e-3), 1e9, ({out} - tt) / {out})",
+            "{out} = np.where({out} > 0.0, {out}, 0.0)",
+        )),
+        ('ST', 3): (('sd', 'demand'), (
+            "{out} = np.zeros(n) if sd == 0.0 else 1.0 - demand / sd",
+        )),
+        ('ST', 4): (('close', 'tw0'), (
+            "{out} = 1.0 - (curr_time - tw0) / close",
+        )),
+        ('ST', 5): (('close', 'release'), (
+            "{out} = release / close",
+        )),
+    }
+
+    _BATCH_OPERATORS: Dict[str, str] = {
+        'add': "{out} = {a} + {b}",
+        'sub': "{out} = {a} - {b}",
+        'mul': "{out} = {a} * {b}",
+        'div': "{out} = np.divide({a}, {b}, out=np.ones(n), where={b} != 0)",
+        'min': "{out} = np.where({b} < {a}, {b}, {a})",
+        'max': "{out} = np.where({b} > {a}, {b}, {a})",
+    }
+
+    @staticmethod
+    def generate_batch_source(root: NodeGP, func_name: str = '_gp_batch', which: Literal['S', 'R'] = 'R') -> Optional[str]:
+        """Sinh mã nguồn phiên bản batch; None nếu cây có terminal không hỗ trợ (R-tree: RT0-RT5, S-tree: ST0-ST5)."""
+        type_str = 'RT' if which == 'R' else 'ST'
+        body: list[str] = []
+        needed: set[str] = set()
+        counter = [0]
+        memo: Dict[Any, Optional[str]] = {}  # terminal / id(node) -> biến đã giữ giá trị
+
+        def emit(node: NodeGP) -> Optional[str]:
+            key = node.terminal if isinstance(node, TerminalNode) else id(node)
+            if key in memo:
+                return memo[key]
+            memo[key] = out = emit_node(node)
+            return out
+
+        def emit_node(node: NodeGP) -> Optional[str]:
+            out = f"v{counter[0]}"
+            counter[0] += 1
+            if isinstance(node, ConstantNode):
+                body.append(f"{out} = np.full(n, {node.value!r})")
+                return out
+            if isinstance(node, TerminalNode):
+                spec = TreeCompiler._BATCH_TERMINALS.get(node.terminal)
+                if spec is None or node.type_str != type_str:
+                    return None
+                deps, lines = spec
+                needed.update(deps)
+                body.extend(line.format(out=out) for line in lines)
+                return out
+            a = emit(node.left)
+            b = emit(node.right)
+            if a is None or b is None:
+                return None
+            body.append(TreeCompiler._BATCH_OPERATORS[node.op].format(out=out, a=a, b=b))
+            return out
+
+        result = emit(root)
+        if result is None:
+            return None
+        prelude = ["n = len(feat['tt'])"]
+        prelude += [line for key, line in TreeCompiler._BATCH_PRELUDE.items() if key in needed]
+        signature = "feat, vehicles, pro, req" if which == 'R' else "feat, veh, pro, curr_time"
+        lines = [f"def {func_name}({signature}):"]
+        lines.append("    with np.errstate(all='ignore'):")
+        lines.extend("        " + line for line in prelude + body)
+        lines.append(f"    return {result}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def compile_batch(root: NodeGP, func_name: str = '_gp_batch', which: Literal['S', 'R'] = 'R') -> Optional[Callable[..., np.ndarray]]:
+        source = TreeCompiler.generate_batch_source(root, func_name, which)
+        if source is None:
+            return None
+        namespace: Dict[str, Any] = {'np': np}
+        exec(compile(source, f"<gp:{func_name}>", 'exec'), namespace)
+        return namespace[func_name]
+
+
+class TreeSimplifier:
+    """
+    Rút gọn cây GP mà không đổi giá trị (với giá trị hữu hạn, đúng theo protected_div):
+    - (min X X), (max X X) -> X;  (sub X X) -> 0;  (div X X) -> 1;  (div X 0) -> 1
+    - (add X 0), (add 0 X), (sub X 0), (mul X 1), (mul 1 X), (div X 1) -> X
+    - toán tử có hai con là hằng số được tính sẵn (gập hằng số).
+    Hai cây con được coi là giống nhau khi có cùng chuỗi dạng chuẩn. Cây con không đổi được giữ nguyên
+    (dùng chung tham chiếu với cây gốc).
+    """
+
+    @staticmethod
+    def simplify(root: NodeGP) -> NodeGP:
+        return TreeSimplifier._simplify(root)[0]
+
+    @staticmethod
+    def _simplify(node: NodeGP) -> Tuple[NodeGP, str]:
+        """Trả về (cây đã rút gọn, chuỗi dạng chuẩn của nó)."""
+        if not isinstance(node, InternalNode):
+            return node, node.to_canonical_string()
+        left, left_key = TreeSimplifier._simplify(node.left)
+        right, right_key = TreeSimplifier._simplify(node.right)
+        op = node.op
+        a = left.value if isinstance(left, ConstantNode) else None
+        b = right.value if isinstance(right, ConstantNode) else None
+
+        def constant(value: float) -> Tuple[NodeGP, str]:
+            const = ConstantNode(value, node.which)
+            return const, const.to_canonical_string()
+
+        if a is not None and b is not None:
+            value = OPERATORS[op](a, b)
+            if math.isfinite(value):
+                return constant(value)
+        if left_key == right_key:
+            if op in ('min', 'max'):
+                return left, left_key
+            if op == 'sub':
+                return constant(0.0)
+            if op == 'div':
+                return constant(1.0)
+        if op == 'add':
+            if b == 0.0:
+                return left, left_key
+            if a == 0.0:
+                return right, right_key
+        elif op == 'sub':
+            if b == 0.0:
+                return left, left_key
+        elif op == 'mul':
+            if b == 1.0:
+                return left, left_key
+            if a == 1.0:
+                return right, right_key
+        elif op == 'div':
+            if b == 1.0:
+                return left, left_key
+            if b == 0.0:
+                return constant(1.0)
+
+        if left is node.left and right is node.right:
+            new_node = node
+        else:
+            new_node = InternalNode(op, left, right, node.which)
+        if op in COMMUTATIVE_OPS and right_key < left_key:
+            left_key, right_key = right_key, left_key
+        return new_node, f"({op} {left_key} {right_key})"
+
+
 class Individual:
     def __init__(self, r_tree: NodeGP, s_tree: NodeGP) -> None:
         self.r_tree = r_tree
@@ -220,13 +868,126 @@ class Individual:
         self.fitness: Optional[Tuple[float, float]] = None
         self.f1: Optional[float] = None
         self.f2: Optional[float] = None
+
+    # Cây được lưu dưới dạng LinearTree (bất biến); r_tree/s_tree là NodeGP dựng lại khi cần.
+    # Hàm đã biên dịch được cache theo cây; gán cây mới sẽ xóa cache.
+    # Không sửa trực tiếp node của r_tree/s_tree, hãy gán lại cây mới: NodeGP được coi là bất biến
+    # nên bản sao và con cháu dùng chung (theo tham chiếu) mọi cây con không bị biến đổi.
+    @property
+    def r_linear(self) -> LinearTree:
+        return self._r_linear
+
+    @r_linear.setter
+    def r_linear(self, tree: LinearTree) -> None:
+        self._r_linear = tree
+        self._r_tree = None
+        self._r_eval_tree = None
+        self._r_func = None
+        self._r_batch_func = False  # False = chưa biên dịch, None = cây không hỗ trợ batch
+
+    @property
+    def s_linear(self) -> LinearTree:
+        return self._s_linear
+
+    @s_linear.setter
+    def s_linear(self, tree: LinearTree) -> None:
+        self._s_linear = tree
+        self._s_tree = None
+        self._s_eval_tree = None
+        self._s_func = None
+        self._s_batch_func = False
+
+    @property
+    def r_tree(self) -> NodeGP:
+        if self._r_tree is None:
+            self._r_tree = self._r_linear.to_node()
+        return self._r_tree
+
+    @r_tree.setter
+    def r_tree(self, tree: NodeGP) -> None:
+        self.r_linear = LinearTree.from_node(tree)
+        self._r_tree = tree
+
+    @property
+    def s_tree(self) -> NodeGP:
+        if self._s_tree is None:
+            self._s_tree = self._s_linear.to_node()
+        return self._s_tree
+
+    @s_tree.setter
+    def s_tree(self, tree: NodeGP) -> None:
+        self.s_linear = LinearTree.from_node(tree)
+        self._s_tree = tree
+
+    # Cây dùng để đánh giá: r_tree/s_tree đã qua TreeSimplifier rồi intern vào SUBTREE_INTERNER (DAG dùng chung).
+    # Hàm biên dịch, các terminal mà simulator dựa vào và khóa cache fitness đều lấy từ cây này;
+    # r_tree/s_tree (kiểu gen) giữ nguyên cho tiến hóa.
+    @property
+    def r_eval_tree(self) -> NodeGP:
+        if self._r_eval_tree is None:
+            self._r_eval_tree = SUBTREE_INTERNER.intern(TreeSimplifier.simplify(self.r_tree))
+        return self._r_eval_tree
+
+    @property
+    def s_eval_tree(self) -> NodeGP:
+        if self._s_eval_tree is None:
+            self._s_eval_tree = SUBTREE_INTERNER.intern(TreeSimplifier.simplify(self.s_tree))
+        return self._s_eval_tree
+
+    def linear(self, which: Literal['S', 'R']) -> LinearTree:
+        return self._r_linear if which == 'R' else self._s_linear
+
+    def cached_node(self, which: Literal['S', 'R']) -> Optional[NodeGP]:
+        """NodeGP của cây R/S nếu đã được dựng, None nếu chưa (không dựng mới)."""
+        return self._r_tree if which == 'R' else self._s_tree
+
+    def set_tree(self, which: Literal['S', 'R'], tree: LinearTree, node: Optional[NodeGP] = None) -> None:
+        """Gán cây mới cho R/S; node (nếu có) là NodeGP tương ứng đã dựng sẵn, dùng lại thay vì dựng từ mảng."""
+        if which == 'R':
+            self.r_linear = tree
+            self._r_tree = node
+        else:
+            self.s_linear = tree
+            self._s_tree = node
+
+    @property
+    def r_func(self) -> Callable[[Vehicle, Problem, Request, float], float]:
+        if self._r_func is None:
+            self._r_func = TreeCompiler.compile(self.r_eval_tree, '_gp_r_tree')
+        return self._r_func
+
+    @property
+    def r_batch_func(self) -> Optional[Callable[..., np.ndarray]]:
+        """Phiên bản batch (NumPy, nhiều xe cùng lúc) của R-tree; None nếu cây không hỗ trợ."""
+        if self._r_batch_func is False:
+            self._r_batch_func = TreeCompiler.compile_batch(self.r_eval_tree, '_gp_r_batch', 'R')
+        return self._r_batch_func
+
+    @property
+    def s_func(self) -> Callable[[Vehicle, Problem, Request, float], float]:
+        if self._s_func is None:
+            self._s_func = TreeCompiler.compile(self.s_eval_tree, '_gp_s_tree')
+        return self._s_func
+
+    @property
+    def s_batch_func(self) -> Optional[Callable[..., np.ndarray]]:
+        """Phiên bản batch (NumPy, cả hàng đợi của một xe cùng lúc) của S-tree; None nếu cây không hỗ trợ."""
+        if self._s_batch_func is False:
+            self._s_batch_func = TreeCompiler.compile_batch(self.s_eval_tree, '_gp_s_batch', 'S')
+        return self._s_batch_func
         
     def copy(self) -> Individual:
-        new_indi = Individual(self.r_tree.copy(), self.s_tree.copy())
+        # LinearTree và NodeGP bất biến nên bản sao dùng chung mảng mã, cây đã dựng và các hàm đã biên dịch
+        new_indi = Individual.__new__(Individual)
+        new_indi.set_tree('R', self._r_linear, self._r_tree)
+        new_indi.set_tree('S', self._s_linear, self._s_tree)
+        new_indi._r_eval_tree, new_indi._s_eval_tree = self._r_eval_tree, self._s_eval_tree
+        new_indi._r_func, new_indi._r_batch_func = self._r_func, self._r_batch_func
+        new_indi._s_func, new_indi._s_batch_func = self._s_func, self._s_batch_func
         new_indi.f1 = self.f1
         new_indi.f2 = self.f2
         new_indi.fitness = self.fitness
         return new_indi
     
     def to_string(self) -> None:
-        print(f"R: {self.r_tree.to_string()} | S: {self.s_tree.to_string()}")
\ No newline at end of file
+        print(f"R: {self.r_tree.to_string()} | S: {self.s_tree.to_string()}")
@@ -1,16 +1,112 @@
 import random
 import math
 import json
+import multiprocessing
 import numpy as np
-from collections import defaultdict
-from typing import Any, List, Tuple, Dict, Optional
+from collections import OrderedDict
+from typing import Any, List, Tuple, Dict, Optional, Set
 
 from .problem_structures import Problem
-from .gp_structure import NodeGP, Individual
+from .gp_structure import NodeGP, Individual, SUBTREE_INTERNER
 from .initializer import PopulationInitializer
 from .simulator import Simulator
 from .gp_operators import GeneticOperator
 
+# -----------------------------------------
+# Worker cho đánh giá song song (process pool)
+# -----------------------------------------
+# Problem được gửi tới mỗi worker một lần khi khởi tạo pool;
+# mỗi lần đánh giá chỉ truyền chuỗi cây và nhận lại tuple fitness.
+# Tham số chặn trội (dominance) của thế hệ được gửi một lần cho mỗi chunk, không lặp lại theo từng cá thể.
+_worker_problem: Optional[Problem] = None
+_worker_assignment_n: int = 1
+_worker_run_limits: Dict[str, Any] = {}
+_worker_sim_options: Dict[str, Any] = {}
+
+def _init_worker(problem: Problem, assignment_n: int, run_limits: Dict[str, Any], sim_options: Dict[str, Any]) -> None:
+    global _worker_problem, _worker_assignment_n, _worker_run_limits, _worker_sim_options
+    _worker_problem = problem
+    _worker_assignment_n = assignment_n
+    _worker_run_limits = run_limits
+    _worker_sim_options = sim_options
+
+def _simulate_tree_strings(
+        r_str: str, 
+        s_str: str, 
+        dominance: Dict[str, Any]
+    ) -> Tuple[float, float, Optional[str], Tuple[int, int, int]]:
+    """
+    Mô phỏng cặp cây (R, S) với tham số chặn trội dominance cho Simulator.run;
+    trả về (f1, f2, lý do dừng sớm hoặc None, bộ đếm chuỗi thay thế (attempts, cycles_skipped, budget_hits)).
+    """
+    ind = Individual(
+        PopulationInitializer.build_tree_from_string(r_str, which='R'),
+        PopulationInitializer.build_tree_from_string(s_str, which='S'),
+    )
+    results = Simulator(_worker_problem, ind, assignment_n=_worker_assignment_n, record_routes=False,
+                        **_worker_sim_options).run(**_worker_run_limits, **dominance)
+    return results['f1'], results['f2'], results['terminated'], _replacement_stats(results)
+
+
+def _simulate_chunk(
+        chunk: Tuple[Dict[str, Any], List[Tuple[str, str]]]
+    ) -> List[Tuple[float, float, Optional[str], Tuple[int, int, int]]]:
+    """chunk = (tham số chặn trội, các cặp chuỗi cây); tham số chặn trội chỉ được gửi một lần cho cả chunk."""
+    dominance, trees = chunk
+    return [_simulate_tree_strings(r_str, s_str, dominance) for r_str, s_str in trees]
+
+
+def _replacement_stats(results: Dict[str, Any]) -> Tuple[int, int, int]:
+    return (results['replacement_attempts'], results['replacement_cycles_skipped'], results['replacement_budget_hits'])
+
+
+class FitnessCache:
+    """
+    Cache LRU cho fitness, khóa là dạng chuẩn của cặp cây (R, S).
+    Simulator tất định với (problem, cây R, cây S, r_alpha, arrival_beta) cố định,
+    nên cá thể trùng lặp (elite, con giống cha mẹ) không cần mô phỏng lại.
+    """
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._data: OrderedDict[Tuple[str, str], Tuple[float, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_of(ind: Individual) -> Tuple[str, str]:
+        return (ind.r_eval_tree.to_canonical_string(), ind.s_eval_tree.to_canonical_string())
+
+    def get(self, key: Tuple[str, str]) -> Optional[Tuple[float, float]]:
+        fitness = self._data.get(key)
+        if fitness is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return fitness
+
+    def put(self, key: Tuple[str, str], fitness: Tuple[float, float]) -> None:
+        self._data[key] = fitness
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop_stats(self) -> Tuple[int, int]:
+        """Trả về (hits, misses) từ lần gọi trước và reset bộ đếm."""
+        stats = (self.hits, self.misses)
+        self.hits = 0
+        self.misses = 0
+        return stats
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
 class NSGA2Optimizer:
     def __init__(
         self, 
@@ -21,7 +117,13 @@ class NSGA2Optimizer:
         elite_ratio: float = 0.1, 
         tourn_size: int = 4, 
         max_depth: int = 6,
-        seed: Optional[int] = None
+        seed: Optional[int] = None,
+        n_workers: int = 1,
+        fitness_cache_size: int = 10000,
+        sim_max_events: Optional[int] = None,
+        sim_time_limit: Optional[float] = None,
+        early_termination: Optional[str] = None,
+        replacement_budget: int = 500
     ):
         self.pop_size = pop_size
         self.max_gen = max_gen
@@ -30,6 +132,32 @@ class NSGA2Optimizer:
         self.elite_size = int(pop_size * elite_ratio) 
         self.tourn_size = tourn_size
         self.max_depth = max_depth
+        # n_workers > 1: đánh giá quần thể bằng process pool (kết quả giống hệt chạy tuần tự)
+        self.n_workers = n_workers
+        self._pool = None
+        # Mảng theo slot của quần thể hiện tại (xem _rank_and_crowd)
+        self._fitness = np.empty((0, 2))
+        self._rank = np.empty(0, dtype=np.int64)
+        self._distance = np.empty(0)
+        # fitness_cache_size = 0: tắt cache
+        self.fitness_cache = FitnessCache(fitness_cache_size) if fitness_cache_size > 0 else None
+        # Giới hạn cho mỗi lần mô phỏng khi tiến hóa (xem Simulator.run); cá thể vượt giới hạn nhận fitness phạt
+        self.run_limits: Dict[str, Any] = {'max_events': sim_max_events, 'time_limit': sim_time_limit}
+        self._terminated_count = 0
+        # Tham số khởi tạo Simulator khi tiến hóa (xem Simulator.__init__)
+        self.sim_options: Dict[str, Any] = {'replacement_budget': replacement_budget}
+        # Bộ đếm chuỗi thay thế (attempts, cycles_skipped, budget_hits) cộng dồn trong một thế hệ
+        self._replacement_counts = [0, 0, 0]
+        # Dừng sớm mô phỏng của con cháu khi cận trên (f1, f2) đã bị trội (xem _dominance_bound):
+        # None = tắt, 'survival' = chắc chắn không lọt vào quần thể sau (kết quả tiến hóa không đổi),
+        # 'front' = bị front hiện tại trội (nhanh hơn, có thể thay đổi quá trình tiến hóa)
+        if early_termination not in (None, 'front', 'survival'):
+            raise ValueError(f"Unknown early_termination mode: {early_termination}")
+        self.early_termination = early_termination
+        self._dominated_count = 0
+        # id() các cá thể con cháu đang mang fitness cận trên (bị dừng sớm vì dominated) trong thế hệ hiện tại
+        self._bounded: Set[int] = set()
+        self._resimulated_count = 0
         
         if seed is not None:
             random.seed(seed)
@@ -44,6 +172,27 @@ class NSGA2Optimizer:
         Thực thi quá trình tiến hóa GPHH sử dụng thuật toán NSGA-II 
         với cơ chế Elitism (Ưu tú hóa).
         """
+        if self.fitness_cache is not None:
+            # Cache chỉ hợp lệ cho một problem / assignment_n
+            self.fitness_cache.clear()
+        # Bảng intern cây con chỉ sống trong một lần tiến hóa
+        SUBTREE_INTERNER.clear()
+        if self.n_workers > 1:
+            self._pool = multiprocessing.Pool(
+                processes=self.n_workers,
+                initializer=_init_worker,
+                initargs=(problem, assignment_n, self.run_limits, self.sim_options)
+            )
+        try:
+            return self._evolve(problem, assignment_n)
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+            SUBTREE_INTERNER.clear()
+
+    def _evolve(self, problem: Problem, assignment_n: int) -> Dict[str, Any]:
         # 1. Khởi tạo quần thể ban đầu
         current_pop = PopulationInitializer.create_greedy_pop(self.pop_size, max_depth=self.max_depth - 1)
         self._evaluate_population(current_pop, problem, assignment_n)
@@ -53,9 +202,7 @@ class NSGA2Optimizer:
         pop_history.append([ind.copy() for ind in current_pop])
         
         # Sắp xếp ban đầu
-        fronts = self._fast_non_dominated_sort(current_pop)
-        for front in fronts:
-            self._assign_crowding_distance(front)
+        self._rank_and_crowd(current_pop)
             
         stats_history = []
         self._record_stats(0, current_pop, stats_history)
@@ -66,9 +213,8 @@ class NSGA2Optimizer:
             offspring = []
             
             # --- ELITISM---
-            sorted_pop = sorted(current_pop, key=lambda x: (x.rank, -x.distance))
-            for i in range(min(self.elite_size, len(sorted_pop))):
-                elite_ind = sorted_pop[i].copy()
+            for i in self._elite_order()[:self.elite_size].tolist():
+                elite_ind = current_pop[i].copy()
                 offspring.append(elite_ind)
             
             # ------Tạo thế hệ con--------
@@ -91,16 +237,17 @@ class NSGA2Optimizer:
             offspring = offspring[:self.pop_size]
             
             # Đánh giá thế hệ con
-            self._evaluate_population(offspring, problem, assignment_n)
+            self._evaluate_population(offspring, problem, assignment_n, self._dominance_bound())
             
             # Kết hợp Parent + Offspring để chọn lọc sinh tồn
             combined_pop = current_pop + offspring
             current_pop = self._survival_selection(combined_pop)
+            # Cá thể mang cận trên vẫn được chọn (chỉ xảy ra với 'front') phải có fitness thật
+            # trước khi xếp hạng, lưu lịch sử và thống kê
+            self._resimulate_bounded(current_pop, problem, assignment_n)
             
             # Sắp xếp lại để chuẩn bị cho thế hệ sau
-            fronts = self._fast_non_dominated_sort(current_pop)
-            for front in fronts:
-                self._assign_crowding_distance(front)
+            self._rank_and_crowd(current_pop)
             
             pop_history.append([ind.copy() for ind in current_pop])
             self._record_stats(gen, current_pop, stats_history)
@@ -119,11 +266,95 @@ class NSGA2Optimizer:
             "best_results": best_results
         }
 
-    def _evaluate_population(self, pop: List[Individual], problem: Problem, assignment_n: int):
+    def _dominance_bound(self) -> Dict[str, Any]:
+        """
+        Tham số dominance_front / dominance_count cho Simulator.run khi đánh giá con cháu của quần thể hiện tại.
+        'survival': cá thể bị ít nhất pop_size cha mẹ trội hẳn thì mọi front đứng trước nó đã đủ pop_size cá thể,
+                    nên nó (và mọi cá thể nó trội) không thể được _survival_selection chọn, dù fitness là cận trên.
+        """
+        if self.early_termination == 'survival':
+            return {'dominance_front': self._fitness, 'dominance_count': self.pop_size}
+        if self.early_termination == 'front':
+            return {'dominance_front': self._fitness[self._rank == 0], 'dominance_count': 1}
+        return {}
+
+    def _evaluate_population(self, pop: List[Individual], problem: Problem, assignment_n: int,
+                             dominance: Optional[Dict[str, Any]] = None):
         """Đánh giá fitness cho toàn bộ quần thể sử dụng Simulator."""
+        dominance = dominance or {}
+        cache = self.fitness_cache
+        if self._pool is not None:
+            # Gom các cá thể cần mô phỏng (mỗi khóa chỉ mô phỏng một lần)
+            waiting: Dict[Tuple[str, str], List[Individual]] = {}
+            payload = []
+            for ind in pop:
+                key = FitnessCache.key_of(ind) if cache is not None else None
+                if key is not None:
+                    if key in waiting:
+                        cache.hits += 1
+                        waiting[key].append(ind)
+                        continue
+                    fitness = cache.get(key)
+                    if fitness is not None:
+                        self._set_fitness(ind, fitness)
+                        continue
+                    waiting[key] = [ind]
+                payload.append((key, ind))
+            trees = [(ind.r_tree.to_string(), ind.s_tree.to_string()) for _, ind in payload]
+            chunksize = max(1, len(trees) // (self.n_workers * 4))
+            chunks = [(dominance, trees[i:i + chunksize]) for i in range(0, len(trees), chunksize)]
+            outcomes = [out for chunk_out in self._pool.map(_simulate_chunk, chunks) for out in chunk_out]
+            for (key, ind), (f1, f2, terminated, counts) in zip(payload, outcomes):
+                fitness = (f1, f2)
+                self._count_replacements(counts)
+                group = [ind] if key is None else waiting[key]
+                if terminated is not None:
+                    self._count_terminated(terminated, group)
+                elif key is not None:
+                    # Kết quả bị dừng sớm (phụ thuộc đồng hồ / quần thể hiện tại) không được cache
+                    cache.put(key, fitness)
+                for same in group:
+                    self._set_fitness(same, fitness)
+            return
+
         for ind in pop:
-            sim = Simulator(problem, ind, assignment_n=assignment_n)
-            sim.run()
+            key = FitnessCache.key_of(ind) if cache is not None else None
+            if key is not None:
+                fitness = cache.get(key)
+                if fitness is not None:
+                    self._set_fitness(ind, fitness)
+                    continue
+            sim = Simulator(problem, ind, assignment_n=assignment_n, record_routes=False, **self.sim_options)
+            results = sim.run(**self.run_limits, **dominance)
+            self._count_replacements(_replacement_stats(results))
+            if sim.terminated is not None:
+                self._count_terminated(sim.terminated, [ind])
+            elif key is not None:
+                cache.put(key, ind.fitness)
+
+    def _count_terminated(self, reason: str, group: List[Individual]) -> None:
+        if reason == "dominated":
+            self._dominated_count += len(group)
+            self._bounded.update(id(ind) for ind in group)
+        else:
+            self._terminated_count += len(group)
+
+    def _resimulate_bounded(self, pop: List[Individual], problem: Problem, assignment_n: int) -> None:
+        """Mô phỏng đầy đủ (không dừng sớm) các cá thể trong pop đang mang fitness cận trên."""
+        bounded = [ind for ind in pop if id(ind) in self._bounded]
+        self._bounded.clear()
+        if bounded:
+            self._resimulated_count += len(bounded)
+            self._evaluate_population(bounded, problem, assignment_n)
+
+    def _count_replacements(self, counts: Tuple[int, int, int]) -> None:
+        for i, n in enumerate(counts):
+            self._replacement_counts[i] += n
+
+    @staticmethod
+    def _set_fitness(ind: Individual, fitness: Tuple[float, float]) -> None:
+        ind.f1, ind.f2 = fitness
+        ind.fitness = (ind.f1, ind.f2)
 
     def _record_stats(self, gen: int, pop: List[Individual], history: List[dict]):
         if not pop: return
@@ -135,8 +366,38 @@ class NSGA2Optimizer:
             "best_served_ratio": best_f1,
             "best_makespan_score": best_f2
         }
+        msg = f"Gen {gen:3d} | Served Ratio: {best_f1:.3f} | Makespan Score: {best_f2:.3f}"
+        if self.fitness_cache is not None:
+            hits, misses = self.fitness_cache.pop_stats()
+            stats["cache_hits"] = hits
+            stats["cache_misses"] = misses
+            msg += f" | Cache hit: {hits}/{hits + misses}"
+        tree_nodes = sum(ind.r_linear.size() + ind.s_linear.size() for ind in pop)
+        eval_nodes = sum(ind.r_eval_tree.size() + ind.s_eval_tree.size() for ind in pop)
+        stats["tree_nodes"] = tree_nodes
+        stats["simplified_nodes"] = eval_nodes
+        msg += f" | Simplified: -{1.0 - eval_nodes / tree_nodes:.1%} nodes"
+        attempts, cycles_skipped, budget_hits = self._replacement_counts
+        stats["replacement_attempts"] = attempts
+        stats["replacement_cycles_skipped"] = cycles_skipped
+        stats["replacement_budget_hits"] = budget_hits
+        if budget_hits:
+            msg += f" | Replacement budget hit: {budget_hits}"
+        self._replacement_counts = [0, 0, 0]
+        stats["terminated"] = self._terminated_count
+        if self._terminated_count:
+            msg += f" | Terminated: {self._terminated_count}"
+        self._terminated_count = 0
+        if self.early_termination is not None:
+            stats["dominated_stopped"] = self._dominated_count
+            stats["dominated_resimulated"] = self._resimulated_count
+            msg += f" | Dominated stop: {self._dominated_count}"
+            if self._resimulated_count:
+                msg += f" (re-simulated: {self._resimulated_count})"
+            self._dominated_count = 0
+            self._resimulated_count = 0
         history.append(stats)
-        print(f"Gen {gen:3d} | Served Ratio: {best_f1:.3f} | Makespan Score: {best_f2:.3f}")
+        print(msg)
 
     def _select_best_individual(self, front: List[Individual], problem: Problem, assignment_n: int):
         """Chọn cá thể có f1 lớn nhất, nếu trùng thì chọn f2 lớn nhất."""
@@ -154,104 +415,158 @@ class NSGA2Optimizer:
         return best_ind, final_results
 
 
-    def _dominate(self, ind1: Individual, ind2: Individual) -> bool:
-        f1_a, f2_a = ind1.fitness
-        f1_b, f2_b = ind2.fitness
-        # Dominate nếu tốt hơn hoặc bằng ở mọi mục tiêu và tốt hơn ít nhất 1 mục tiêu
-        if (f1_a >= f1_b and f2_a >= f2_b) and (f1_a > f1_b or f2_a > f2_b):
-            return True
-        return False
+    # -----------------------------------------
+    # Xếp hạng & chọn lọc trên mảng NumPy
+    # -----------------------------------------
+    # fitness, rank, crowding distance của quần thể hiện tại được lưu theo vị trí (slot) trong quần thể:
+    # self._fitness[i], self._rank[i], self._distance[i] ứng với current_pop[i].
 
-    def _fast_non_dominated_sort(self, pop: List[Individual]) -> List[List[Individual]]:
-        fronts = [[]]
-        domination_count = defaultdict(int) 
-        dominated_solutions = defaultdict(list) 
-        
-        for p in pop:
-            domination_count[p] = 0 # Reset count
-            for q in pop:
-                if p == q: continue
-                if self._dominate(p, q):
-                    dominated_solutions[p].append(q)
-                elif self._dominate(q, p):
-                    domination_count[p] += 1
-            
-            if domination_count[p] == 0:
-                p.rank = 0
-                fronts[0].append(p)
-        
-        i = 0
-        while fronts[i]:
-            next_front = []
-            for p in fronts[i]:
-                for q in dominated_solutions[p]:
-                    domination_count[q] -= 1
-                    if domination_count[q] == 0:
-                        q.rank = i + 1
-                        next_front.append(q)
-            i += 1
-            if next_front:
-                fronts.append(next_front)
+    @staticmethod
+    def _fitness_array(pop: List[Individual]) -> np.ndarray:
+        if not pop:
+            return np.empty((0, 2))
+        return np.array([ind.fitness for ind in pop], dtype=float)
+
+    def _rank_and_crowd(self, pop: List[Individual]) -> None:
+        """Tính rank và crowding distance cho pop, lưu vào các mảng theo slot (và đồng bộ ind.rank, ind.distance)."""
+        fitness = self._fitness_array(pop)
+        rank = np.zeros(len(pop), dtype=np.int64)
+        distance = np.zeros(len(pop))
+        for r, front in enumerate(self._non_dominated_fronts(fitness)):
+            rank[front] = r
+            distance[front] = self._crowding_distance(fitness[front])
+
+        self._fitness = fitness
+        self._rank = rank
+        self._distance = distance
+        for ind, r, d in zip(pop, rank.tolist(), distance.tolist()):
+            ind.rank = r
+            ind.distance = d
+
+    def _non_dominated_fronts(self, fitness: np.ndarray) -> List[np.ndarray]:
+        """Trả về các front dưới dạng mảng chỉ số (tăng dần). Trường hợp 2 mục tiêu dùng sort-and-sweep O(N log N)."""
+        if len(fitness) == 0:
+            return []
+        if fitness.shape[1] == 2:
+            rank = self._two_objective_ranks(fitness)
+        else:
+            rank = self._general_ranks(fitness)
+        order = np.argsort(rank, kind='stable')
+        bounds = np.flatnonzero(np.diff(rank[order])) + 1
+        return np.split(order, bounds)
+
+    @staticmethod
+    def _two_objective_ranks(fitness: np.ndarray) -> np.ndarray:
+        """
+        Duyệt các cá thể theo f1 giảm dần (trùng thì f2 giảm dần). Trong mỗi front, cá thể được thêm
+        sau có f2 không nhỏ hơn, nên front k dominate p khi và chỉ khi cá thể cuối của front k dominate p.
+        Tính chất này đơn điệu theo k nên tìm front của p bằng binary search.
+        """
+        order = np.lexsort((-fitness[:, 1], -fitness[:, 0]))
+        values = fitness.tolist()
+        rank = np.empty(len(fitness), dtype=np.int64)
+        last_f1: List[float] = []  # fitness của cá thể được thêm cuối cùng vào mỗi front
+        last_f2: List[float] = []
+        for i in order.tolist():
+            f1, f2 = values[i]
+            lo, hi = 0, len(last_f1)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                # cá thể cuối của front mid có f1 >= f1 (do thứ tự duyệt)
+                if last_f2[mid] > f2 or (last_f2[mid] == f2 and last_f1[mid] > f1):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo == len(last_f1):
+                last_f1.append(f1)
+                last_f2.append(f2)
             else:
-                break
-        
-        if not fronts[-1]:
-            fronts.pop()
-            
+                last_f1[lo] = f1
+                last_f2[lo] = f2
+            rank[i] = lo
+        return rank
+
+    @staticmethod
+    def _general_ranks(fitness: np.ndarray) -> np.ndarray:
+        """Fast non-dominated sort O(M·N²) cho số mục tiêu bất kỳ."""
+        # dominates[p, q]: p tốt hơn hoặc bằng q ở mọi mục tiêu và tốt hơn ít nhất 1 mục tiêu
+        ge = (fitness[:, None, :] >= fitness[None, :, :]).all(axis=2)
+        gt = (fitness[:, None, :] > fitness[None, :, :]).any(axis=2)
+        dominates = ge & gt
+        domination_count = dominates.sum(axis=0)
+        rank = np.full(len(fitness), -1, dtype=np.int64)
+        current = np.flatnonzero(domination_count == 0)
+        r = 0
+        while current.size:
+            rank[current] = r
+            domination_count = domination_count - dominates[current].sum(axis=0)
+            domination_count[rank >= 0] = -1
+            current = np.flatnonzero(domination_count == 0)
+            r += 1
+        return rank
+
+    def _fast_non_dominated_sort(self, pop: List[Individual]) -> List[List[Individual]]:
+        """Gán ind.rank và trả về các front (mỗi front giữ thứ tự như trong pop)."""
+        fronts = []
+        for r, front in enumerate(self._non_dominated_fronts(self._fitness_array(pop))):
+            members = [pop[i] for i in front.tolist()]
+            for ind in members:
+                ind.rank = r
+            fronts.append(members)
         return fronts
 
-    def _assign_crowding_distance(self, front: List[Individual]) -> None:
-        l = len(front)
-        if l == 0: return
-        
-        for indi in front:
-            indi.distance = 0
-            
-        # Tính cho từng mục tiêu (2 mục tiêu)
-        for m in range(2):
-            front.sort(key=lambda x: x.fitness[m])
-            
-            front[0].distance = float('inf')
-            front[-1].distance = float('inf')
-            
-            f_min = front[0].fitness[m]
-            f_max = front[-1].fitness[m]
-            
+    @staticmethod
+    def _crowding_distance(front_fitness: np.ndarray) -> np.ndarray:
+        """Crowding distance của một front (các hàng của front_fitness)."""
+        l, n_obj = front_fitness.shape
+        distance = np.zeros(l)
+        if l == 0:
+            return distance
+        for m in range(n_obj):
+            values = front_fitness[:, m]
+            order = np.argsort(values, kind='stable')
+            distance[order[0]] = np.inf
+            distance[order[-1]] = np.inf
+
+            f_min = values[order[0]]
+            f_max = values[order[-1]]
             if f_min == f_max: continue
-            
-            norm = f_max - f_min
-            
-            for i in range(1, l-1):
-                front[i].distance += (front[i+1].fitness[m] - front[i-1].fitness[m]) / norm
+
+            sorted_values = values[order]
+            distance[order[1:-1]] += (sorted_values[2:] - sorted_values[:-2]) / (f_max - f_min)
+        return distance
+
+    def _elite_order(self) -> np.ndarray:
+        """Thứ tự quần thể hiện tại theo (rank tăng, distance giảm), giữ thứ tự slot khi bằng nhau."""
+        return np.lexsort((-self._distance, self._rank))
 
     def _tournament_selection(self, pop: List[Individual]) -> Individual:
         """Binary Tournament Selection dựa trên Rank và Crowding Distance."""
-        tourn = random.sample(pop, self.tourn_size)
-        
-        best = tourn[0]
-        for candidate in tourn[1:]:
-            if candidate.rank < best.rank:
-                best = candidate
-            elif candidate.rank == best.rank:
-                if candidate.distance > best.distance:
-                    best = candidate
-        return best
+        tourn = random.sample(range(len(pop)), self.tourn_size)
+        # rank nhỏ nhất, sau đó distance lớn nhất; bằng nhau thì lấy cá thể được chọn trước
+        best = np.lexsort((-self._distance[tourn], self._rank[tourn]))[0]
+        return pop[tourn[best]]
 
     def _survival_selection(self, combined_pop: List[Individual]) -> List[Individual]:
         """Chọn lọc sinh tồn để giữ kích thước quần thể ổn định."""
-        fronts = self._fast_non_dominated_sort(combined_pop)
-        new_pop = []
-        
-        for front in fronts:
-            self._assign_crowding_distance(front)
-            # Sort theo distance giảm dần (càng xa càng tốt)
-            front.sort(key=lambda x: x.distance, reverse=True)
-            
-            if len(new_pop) + len(front) <= self.pop_size:
-                new_pop.extend(front)
+        fitness = self._fitness_array(combined_pop)
+        selected: List[np.ndarray] = []
+        n_selected = 0
+
+        for front in self._non_dominated_fronts(fitness):
+            front_fitness = fitness[front]
+            distance = self._crowding_distance(front_fitness)
+            # Sort theo distance giảm dần (càng xa càng tốt); bằng nhau thì theo f2, f1 tăng dần rồi thứ tự trong front
+            order = np.lexsort(tuple(front_fitness.T) + (-distance,))
+            front = front[order]
+
+            if n_selected + len(front) <= self.pop_size:
+                selected.append(front)
+                n_selected += len(front)
             else:
-                needs = self.pop_size - len(new_pop)
-                new_pop.extend(front[:needs])
+                selected.append(front[:self.pop_size - n_selected])
                 break
-        
-        return new_pop
\ No newline at end of file
+
+        if not selected:
+            return []
+        return [combined_pop[i] for i in np.concatenate(selected).tolist()]
@@ -1,6 +1,8 @@
 import os
+import copy
 import math
 import json
+import numpy as np
 from typing import Any, Literal, Optional
 from dataclasses import dataclass, field
 from abc import ABC, abstractmethod
@@ -22,6 +24,14 @@ class Request:
     
     def __post_init__(self):
         self.time_window = (self.e_i, self.l_i)
+
+    def spawn(self) -> 'Request':
+        """Bản sao cho một lần mô phỏng: dùng chung dữ liệu tĩnh (tuple bất biến), chỉ reset các cờ trạng thái."""
+        req = copy.copy(self)
+        req.is_picked_up = False
+        req.is_served = False
+        req.pickup_time = None
+        return req
     
 class Vehicle(ABC):
     def __init__(
@@ -36,13 +46,48 @@ class Vehicle(ABC):
         self.remaining_capacity: float = capacity
         self.velocity: float = velocity
         self.current_location: tuple[float, float] = start_location
+        # Chỉ số vị trí trong bảng khoảng cách của Problem: 0 = depot, i = request có id i
+        self.current_loc_idx: int = 0
+        self.distances: Optional[list[list[float]]] = None
+        self.travel_times: Optional[list[list[float]]] = None
+        # Cột tĩnh lấy từ bảng đặc trưng request của Problem (theo chỉ số vị trí)
+        self.return_times: Optional[list[float]] = None
+        self.depot_distances: Optional[list[float]] = None
         self.req_queue: list[Request] = []
+        # Tổng demand và tọa độ của req_queue, cộng dồn khi thêm request.
+        # Khi bớt request chỉ đánh dấu và tính lại một lần ở lần đọc kế tiếp,
+        # để kết quả luôn bằng đúng phép cộng tuần tự theo thứ tự hàng đợi.
+        self._queue_demand: float = 0.0
+        self._queue_sum_x: float = 0.0
+        self._queue_sum_y: float = 0.0
+        self._queue_dirty: bool = False
+        # Tăng mỗi khi trạng thái xe thay đổi (hàng đợi, vị trí, tải, range, busy_until);
+        # Simulator dùng để biết khi nào phải tính lại điểm R-tree của xe
+        self.state_version: int = 0
         self.picked_up_orders: list[Request] = []
         self.busy_until: float = 0.0
         # self.routes: list[list[int | str]] = []
         self.routes: list[list[dict]] = []
         # self.current_trip = None
+        # Thông tin chờ tại depot (Just-in-Time) do Simulator quản lý
+        self.scheduled_wake_time: Optional[float] = None
+        self.waiting_for_req_id: Optional[int] = None
+        self.waiting_for_s_score: Optional[float] = None
     
+    def attach_tables(self, distances: list[list[float]], travel_times: list[list[float]],
+                      return_times: list[float], depot_distances: list[float]) -> None:
+        """Gắn bảng khoảng cách, bảng thời gian di chuyển (theo vận tốc của loại xe) và thời gian / khoảng cách về depot đã tính sẵn."""
+        self.distances = distances
+        self.travel_times = travel_times
+        self.return_times = return_times
+        self.depot_distances = depot_distances
+
+    def travel_time_to(self, loc_idx: int) -> float:
+        return self.travel_times[self.current_loc_idx][loc_idx]
+
+    def distance_to_index(self, loc_idx: int) -> float:
+        return self.distances[self.current_loc_idx][loc_idx]
+
     def moving_time_to(self, location: tuple[float, float]) -> float:
         dis = self.distance_to(location)
         return dis / self.velocity
@@ -51,10 +96,39 @@ class Vehicle(ABC):
         dis = math.sqrt((loc_a[0]-loc_b[0])**2+(loc_a[1]-loc_b[1])**2)
         return dis / self.velocity
     
+    def enqueue(self, req: Request) -> None:
+        self.req_queue.append(req)
+        self.state_version += 1
+        if not self._queue_dirty:
+            self._queue_demand += req.demand
+            self._queue_sum_x += req.location[0]
+            self._queue_sum_y += req.location[1]
+
+    def remove_from_queue(self, req: Request) -> None:
+        self.req_queue = [r for r in self.req_queue if r.id != req.id]
+        self._queue_dirty = True
+        self.state_version += 1
+
+    def prune_queue(self) -> None:
+        """Loại bỏ các request đã được lấy hoặc đã phục vụ khỏi hàng đợi."""
+        queue = [rq for rq in self.req_queue if (not rq.is_picked_up) and (not rq.is_served)]
+        if len(queue) != len(self.req_queue):
+            self._queue_dirty = True
+            self.state_version += 1
+        self.req_queue = queue
+
+    def _refresh_queue_aggregates(self) -> None:
+        self._queue_demand = sum([req.demand for req in self.req_queue])
+        self._queue_sum_x = sum([req.location[0] for req in self.req_queue])
+        self._queue_sum_y = sum([req.location[1] for req in self.req_queue])
+        self._queue_dirty = False
+
     def sum_of_req_demand(self) -> float:
         if not self.req_queue:
             return 0.0
-        return sum([req.demand for req in self.req_queue])
+        if self._queue_dirty:
+            self._refresh_queue_aggregates()
+        return self._queue_demand
     
     def distance_to(self, location: tuple[float, float]):
         return math.sqrt((self.current_location[0]-location[0])**2+(self.current_location[1]-location[1])**2)
@@ -62,14 +136,21 @@ class Vehicle(ABC):
     def median_of_req_loc(self) -> float:
         if not self.req_queue:
             return self.current_location
-        avg_x = sum([req.location[0] for req in self.req_queue]) / len(self.req_queue)
-        avg_y = sum([req.location[1] for req in self.req_queue]) / len(self.req_queue)
+        if self._queue_dirty:
+            self._refresh_queue_aggregates()
+        avg_x = self._queue_sum_x / len(self.req_queue)
+        avg_y = self._queue_sum_y / len(self.req_queue)
         return (avg_x, avg_y)
     
     @abstractmethod
     def can_handle_request(self, req: Request) -> bool:
         pass
 
+    @abstractmethod
+    def spawn(self) -> 'Vehicle':
+        """Tạo xe mới ở trạng thái ban đầu với cùng thông số (id, capacity, velocity, ...)."""
+        pass
+
     def recharge(self) -> None:
         pass  # Chỉ override ở Drone
     
@@ -81,6 +162,11 @@ class Truck(Vehicle):
 
     def can_handle_request(self, req: Request) -> bool:
         return self.remaining_capacity >= req.demand  
+
+    def spawn(self) -> 'Truck':
+        veh = Truck(self.id, self.capacity, self.velocity)
+        veh.attach_tables(self.distances, self.travel_times, self.return_times, self.depot_distances)
+        return veh
     
 class Drone(Vehicle):
     def __init__(self, id: int, capacity: float, velocity: float, max_range: float):
@@ -89,26 +175,42 @@ class Drone(Vehicle):
         self.remaining_range: float = max_range
         self.type: str = 'DRONE'
     
-    def check_can_fly(self, location: float) -> bool:
-        travel_time = self.moving_time_to(location)
-        return_time = self.moving_time(location, (0.0, 0.0))
+    def check_can_fly(self, loc_idx: int) -> bool:
+        travel_time = self.travel_time_to(loc_idx)
+        return_time = self.return_times[loc_idx]
         return self.remaining_range >= travel_time + return_time
     
     def can_handle_request(self, req: Request) -> bool:
         if not req.able_drone:
             return False
-        travel_time = self.moving_time_to(req.location)
-        return_time = self.moving_time(req.location, (0.0, 0.0))
+        travel_time = self.travel_time_to(req.id)
+        return_time = self.return_times[req.id]
         return (self.remaining_capacity >= req.demand) and (self.remaining_range >= travel_time + return_time)
     
     def recharge(self) -> None:
         self.remaining_range = self.max_range
+
+    def spawn(self) -> 'Drone':
+        veh = Drone(self.id, self.capacity, self.velocity, self.max_range)
+        veh.attach_tables(self.distances, self.travel_times, self.return_times, self.depot_distances)
+        return veh
         
 class Problem:
     def __init__(self, depot_time_window_end: float) -> None:
         self.requests: list[Request] = []
         self.vehicles: list[Vehicle] = []
         self.depot_time_window: tuple[float, float] = (0.0, depot_time_window_end)
+        # Bảng (n+1)x(n+1): chỉ số 0 = depot, i = request có id i
+        self.distance_matrix: list[list[float]] = []
+        self.travel_time_matrix: dict[str, list[list[float]]] = {}
+        # Cùng dữ liệu dạng NumPy (loại xe x (n+1) x (n+1)), thứ tự loại xe theo vehicle_types
+        self.vehicle_types: list[str] = []
+        self.travel_time_array: np.ndarray = np.empty((0, 0, 0))
+        self.distance_array: np.ndarray = np.empty((0, 0))
+        # Bảng đặc trưng tĩnh của request, mỗi cột là một mảng NumPy chỉ số theo id (phần tử 0 = depot)
+        self.request_features: dict[str, np.ndarray] = {}
+        # reachable_types[id]: các loại xe có thể phục vụ request (rỗng = không xe nào phục vụ được)
+        self.reachable_types: list[frozenset[str]] = []
     
     @classmethod
     def load_from_file(cls, file_path: str) -> 'Problem':
@@ -150,11 +252,108 @@ class Problem:
             pro.vehicles.append(Drone(v_id, d_cap, d_vel, d_lim))
             v_id += 1
 
+        pro.build_travel_tables()
         return pro
-    
+
+    def build_travel_tables(self) -> None:
+        """
+        Tính sẵn bảng khoảng cách giữa depot và các request, và bảng thời gian di chuyển cho từng loại xe.
+        Yêu cầu request có id i nằm ở vị trí i-1 trong self.requests (như load_from_file tạo ra).
+        """
+        points = [(0.0, 0.0)] + [req.location for req in self.requests]
+        self.distance_matrix = [
+            [math.sqrt((a[0]-b[0])**2+(a[1]-b[1])**2) for b in points]
+            for a in points
+        ]
+        self.travel_time_matrix = {}
+        for veh in self.vehicles:
+            if veh.type not in self.travel_time_matrix:
+                self.travel_time_matrix[veh.type] = [
+                    [dis / veh.velocity for dis in row] for row in self.distance_matrix
+                ]
+        self.vehicle_types = list(self.travel_time_matrix)
+        self.travel_time_array = np.array([self.travel_time_matrix[t] for t in self.vehicle_types])
+        self.distance_array = np.array(self.distance_matrix)
+        self.build_request_features()
+
+        return_times = {t: self.request_features['return_time'][i].tolist() for i, t in enumerate(self.vehicle_types)}
+        depot_distances = self.request_features['depot_distance'].tolist()
+        for veh in self.vehicles:
+            veh.attach_tables(self.distance_matrix, self.travel_time_matrix[veh.type], return_times[veh.type], depot_distances)
+
+    def build_request_features(self) -> None:
+        """
+        Tính bảng đặc trưng không đổi trong suốt quá trình mô phỏng cho mỗi request (dùng chung cho mọi cá thể).
+        Các cột theo loại xe ('return_time', 'round_trip', 'reachable') có dạng (loại xe x (n+1)), thứ tự theo vehicle_types.
+        'reachable' là điều kiện cần để một xe thuộc loại đó có thể phục vụ request: đủ tải (so với xe lớn nhất),
+        kịp về depot nếu bắt đầu phục vụ ngay lúc mở cửa sổ, và với DRONE: được phép bay, đủ range cho chuyến depot-request-depot.
+        """
+        reqs = [None] + sorted(self.requests, key=lambda r: r.id)
+        close = self.depot_time_window[1]
+
+        def column(getter, dtype=float) -> np.ndarray:
+            return np.array([0 if r is None else getter(r) for r in reqs], dtype=dtype)
+
+        f: dict[str, np.ndarray] = {
+            'release': column(lambda r: r.release_time),
+            'tw0': column(lambda r: r.time_window[0]),
+            'tw1': column(lambda r: r.time_window[1]),
+            'demand': column(lambda r: r.demand),
+            'l_w': column(lambda r: r.l_w),
+            'able_drone': column(lambda r: r.able_drone, bool),
+        }
+        f['depot_distance'] = self.distance_array[0].copy()
+        f['return_time'] = self.travel_time_array[:, :, 0].copy()
+        f['round_trip'] = self.travel_time_array[:, 0, :] + f['return_time']
+
+        reachable = np.zeros((len(self.vehicle_types), len(reqs)), dtype=bool)
+        for i, vtype in enumerate(self.vehicle_types):
+            fleet = [veh for veh in self.vehicles if veh.type == vtype]
+            ok = f['demand'] <= max(veh.capacity for veh in fleet) + 1e-6
+            ok &= f['tw0'] + f['return_time'][i] <= close + 1e-6
+            if vtype == 'DRONE':
+                ok &= f['able_drone']
+                ok &= f['round_trip'][i] <= max(veh.max_range for veh in fleet)
+            reachable[i] = ok
+        reachable[:, 0] = False
+        f['reachable'] = reachable
+        self.request_features = f
+        self.reachable_types = [
+            frozenset(t for i, t in enumerate(self.vehicle_types) if reachable[i, rid])
+            for rid in range(len(reqs))
+        ]
+
     def sum_of_req_demand(self) -> float:
         if not self.requests:
             return 0.0
         return sum([req.demand for req in self.requests])
 
-        
\ No newline at end of file
+
+class SimulationState:
+    """
+    Trạng thái thay đổi trong một lần mô phỏng: xe (vị trí, tải, hàng đợi) và các request đã xuất hiện.
+    Dữ liệu tĩnh (vị trí, demand, time window, thông số đội xe) được đọc trực tiếp từ Problem gốc,
+    không sao chép. Cung cấp cùng giao diện với Problem mà các terminal sử dụng.
+    """
+    def __init__(self, problem: Problem) -> None:
+        self.instance = problem
+        self.depot_time_window: tuple[float, float] = problem.depot_time_window
+        self.vehicles: list[Vehicle] = []
+        self.requests: list[Request] = []
+        self.reset()
+
+    def reset(self) -> None:
+        """Đưa trạng thái về thời điểm bắt đầu mô phỏng."""
+        self.vehicles = [veh.spawn() for veh in self.instance.vehicles]
+        self.requests = []
+        # requests chỉ được thêm vào (không bớt) nên tổng demand được cộng dồn
+        self._requests_demand = 0.0
+
+    def add_request(self, req: Request) -> None:
+        self.requests.append(req)
+        self._requests_demand += req.demand
+
+    def sum_of_req_demand(self) -> float:
+        if not self.requests:
+            return 0.0
+        return self._requests_demand
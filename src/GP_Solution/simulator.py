@@ -1,83 +1,194 @@
 # simulator.py
-import copy
 import heapq
-import math
+import bisect
+import time
+from collections import deque
+import numpy as np
 from typing import Any, Literal, Optional, Iterable, Set, List, Tuple, Dict
-from .problem_structures import Vehicle, Problem, Request
-from .gp_structure import Individual
+from .problem_structures import Vehicle, Problem, Request, SimulationState
+from .gp_structure import Individual, ARRIVAL_DEPENDENT_TERMINALS, TIME_DEPENDENT_TERMINALS, VEHICLE_DEPENDENT_TERMINALS
+
+# Sự kiện trong event_queue: (time, kind, key1, key2, seq, obj_id, action, detail)
+# - kind: thứ tự khi cùng thời điểm ARRIVE < END < VEH_FREE
+# - ARRIVE: key1, key2 = (l_i, -demand) của request, obj_id = req.id
+# - VEH_FREE: key1 = veh.id, key2 = action, obj_id = veh.id, detail = req.id / số đơn đã phục vụ
+# - seq tăng dần theo thứ tự push, phá hòa ổn định nên không bao giờ phải so sánh phần payload
+EV_ARRIVE, EV_END, EV_VEH_FREE = 0, 1, 2
+ACT_NONE, ACT_PICKUP, ACT_RETURN, ACT_WAKE_UP = 0, 1, 2, 3
+
+# Fitness gán cho cá thể bị dừng sớm vì vượt ngân sách (kém nhất có thể: cả f1 và f2 đều >= 0)
+PENALIZED_FITNESS = (0.0, 0.0)
+# Số sự kiện giữa hai lần đọc đồng hồ khi có giới hạn thời gian
+_CLOCK_CHECK_INTERVAL = 256
+# Số sự kiện giữa hai lần tính cận trên (f1, f2) khi có dominance_front
+_BOUND_CHECK_INTERVAL = 32
 
 class Simulator:
     def __init__(self, problem: Problem, individual: Individual, assignment_n: int = 1, enable_logging: bool = False,
-                 r_alpha: float = 0.7, arrival_beta: float = 0.3):
+                 r_alpha: float = 0.7, arrival_beta: float = 0.3, record_routes: bool = True,
+                 batch_min_fleet: int = 16, batch_min_queue: int = 16, replacement_budget: int = 500):
         """
         Khởi tạo Simulator với Problem và Individual cụ thể.
         r_alpha, arrival_beta: trọng số để kết hợp R-tree score và projected arrival time
+        record_routes: False -> chỉ tính fitness (không ghi veh.routes, kết quả chỉ gồm các bộ đếm),
+                       dùng khi đánh giá quần thể trong quá trình tiến hóa
+        batch_min_fleet: đội xe từ số lượng này trở lên thì xếp hạng xe cho request bằng NumPy (batch)
+        batch_min_queue: hàng đợi của xe từ số lượng này trở lên thì chọn request để phục vụ bằng NumPy (batch)
+        replacement_budget: số lần thử gán lại tối đa trong một chuỗi thay thế (request bị đẩy ra lại đẩy request khác);
+                            hết ngân sách thì các request còn lại trong chuỗi được đưa vào pending
         """
+        if batch_min_fleet < 1 or batch_min_queue < 1:
+            raise ValueError(f"batch_min_fleet and batch_min_queue must be positive, got {batch_min_fleet}, {batch_min_queue}")
+
         # Lưu reference gốc để lấy dữ liệu requests ban đầu
         self.original_requests = problem.requests
 
-        # Deepcopy problem để chạy local simulation không ảnh hưởng dữ liệu gốc
-        self.problem = copy.deepcopy(problem)
-        self.problem.requests = []  # Bắt đầu với list rỗng, sẽ thêm vào khi có sự kiện ARRIVE
-
-        # Reset hàng đợi của các xe trong bản copy và đảm bảo thuộc tính wake-related tồn tại
-        for veh in self.problem.vehicles:
-            veh.req_queue = []
-            # add wake-related attributes dynamically if they don't exist
-            if not hasattr(veh, 'scheduled_wake_time'):
-                veh.scheduled_wake_time: Optional[float] = None
-                setattr(veh, 'scheduled_wake_time', None)
-            if not hasattr(veh, 'waiting_for_req_id'):
-                setattr(veh, 'waiting_for_req_id', None)
-            if not hasattr(veh, 'waiting_for_s_score'):
-                setattr(veh, 'waiting_for_s_score', None)
+        # Trạng thái riêng của lần chạy này (xe mới, chưa có request nào); dữ liệu tĩnh dùng chung với problem gốc.
+        # requests bắt đầu rỗng, sẽ thêm vào khi có sự kiện ARRIVE
+        self.problem = SimulationState(problem)
 
         self.individual = individual
+        # Hàm đánh giá cây đã biên dịch (cache trên individual, chỉ biên dịch một lần)
+        self.r_eval = individual.r_func
+        self.s_eval = individual.s_func
         self.assignment_n = assignment_n
         self.enable_logging = enable_logging
+        self.record_routes = record_routes
 
         # Heuristic weights
         self.r_alpha = r_alpha
         self.arrival_beta = arrival_beta
 
+        # Giới hạn chuỗi thay thế và các bộ đếm (báo cáo trong kết quả)
+        self.replacement_budget = replacement_budget
+        self.replacement_attempts = 0
+        self.replacement_cycles_skipped = 0
+        self.replacement_budget_hits = 0
+        # Lý do dừng sớm của run() ("max_events" / "time_limit" / "dominated"), None nếu chạy hết
+        self.terminated: Optional[str] = None
+        # Cận trên (f1, f2) tại thời điểm dừng vì "dominated"
+        self.fitness_bound: Optional[Tuple[float, float]] = None
+
         # State
         self.cur_time = 0.0
         self.event_queue = []
-        self.pending_requests: List[Request] = []
+        # Request chưa gán được, luôn giữ theo thứ tự (deadline, -demand, thứ tự thêm vào): phần tử là (l_i, -demand, seq, req)
+        self.pending_requests: List[Tuple[float, float, int, Request]] = []
+        self._pending_seq = 0
+        # Chữ ký (tổng state_version của đội xe, số request đã xuất hiện) sau lượt thử lại pending gần nhất
+        # mà không gán được request nào; None nếu lượt gần nhất có gán được hoặc chưa thử lần nào
+        self._pending_stale_key: Optional[Tuple[int, int]] = None
         self.log_events: List[str] = []
 
+        # Cache điểm R-tree theo (req.id, veh.id) -> (khóa phiên bản, r_score hoặc None nếu xe không thể nhận).
+        # Khóa gồm state_version của xe, và số request đã xuất hiện / thời điểm hiện tại nếu R-tree phụ thuộc vào chúng.
+        self._r_score_cache: Dict[int, Dict[int, Tuple[Tuple[int, int, float], Optional[float]]]] = {}
+        r_terminals = individual.r_eval_tree.terminals()
+        self._r_uses_arrivals = bool(r_terminals & ARRIVAL_DEPENDENT_TERMINALS)
+        self._r_uses_time = bool(r_terminals & TIME_DEPENDENT_TERMINALS)
+
+        # Slot của mỗi xe (vị trí trong problem.vehicles), dùng cho mảng đội xe và chỉ mục xe đang ngủ
+        self._fleet_slot = {veh.id: slot for slot, veh in enumerate(self.problem.vehicles)}
+
+        # Đánh giá batch R-tree cho đội xe lớn (None nếu không dùng)
+        self.r_batch_eval = None
+        if len(self.problem.vehicles) >= batch_min_fleet:
+            self.r_batch_eval = individual.r_batch_func
+        if self.r_batch_eval is not None:
+            # Trạng thái đội xe dạng mảng theo slot (vị trí trong problem.vehicles), cập nhật qua _sync_fleet
+            vehicles = self.problem.vehicles
+            self._fleet_ids = np.array([veh.id for veh in vehicles])
+            self._fleet_is_drone = np.array([veh.type == "DRONE" for veh in vehicles])
+            self._fleet_capacity = np.array([veh.capacity for veh in vehicles], dtype=float)
+            self._fleet_type = np.array([problem.vehicle_types.index(veh.type) for veh in vehicles])
+            self._fleet_travel_times = problem.travel_time_array
+            self._fleet_loc = np.zeros(len(vehicles), dtype=np.int64)
+            self._fleet_busy = np.zeros(len(vehicles))
+            self._fleet_range = np.array([getattr(veh, 'remaining_range', 0.0) for veh in vehicles], dtype=float)
+
+        # Chọn request trong hàng đợi bằng batch S-tree khi hàng đợi đủ dài
+        self.batch_min_queue = batch_min_queue
+        self._type_travel_times = {t: problem.travel_time_array[i] for i, t in enumerate(problem.vehicle_types)}
+        self._type_return_times = {t: problem.request_features['return_time'][i] for i, t in enumerate(problem.vehicle_types)}
+        self._distance_array = problem.distance_array
+        # Bảng đặc trưng tĩnh của request (dùng chung cho mọi cá thể)
+        self._features = problem.request_features
+        self._reachable_types = problem.reachable_types
+
+        # Tra cứu xe theo id, và các xe đang ngủ chờ tại depot sắp theo waiting_for_s_score giảm dần:
+        # phần tử (-waiting_s, slot, veh.id); _sleep_entries[veh.id] giữ phần tử hiện tại của xe (nếu có)
+        self._vehicles_by_id = {veh.id: veh for veh in self.problem.vehicles}
+        self._sleeping: List[Tuple[float, int, int]] = []
+        self._sleep_entries: Dict[int, Tuple[float, int, int]] = {}
+        # S-tree không phụ thuộc xe -> điểm của request mới như nhau với mọi xe đang ngủ, có thể dừng sớm khi duyệt
+        self._s_uses_vehicle = bool(individual.s_eval_tree.terminals() & VEHICLE_DEPENDENT_TERMINALS)
+
         # Map để tra cứu request gốc
         self.source_requests_map = {r.id: r for r in self.original_requests}
+        # Số request sẽ xuất hiện trước sự kiện END (ARRIVE cùng thời điểm được xử lý trước END)
+        end_time = self.problem.depot_time_window[1] + 1e-9
+        self._final_total = sum(1 for r in self.original_requests if r.release_time <= end_time)
 
         # Khởi tạo các sự kiện ban đầu
         self._initialize_events()
 
     def _initialize_events(self):
         """Thêm các sự kiện ARRIVE ban đầu và sự kiện END vào hàng đợi."""
+        self._event_seq = 0
         for req in self.original_requests:
-            priority = (req.time_window[1], -req.demand)
-            heapq.heappush(self.event_queue, (req.release_time, "ARRIVE", (priority, req.id)))
+            self._push_event(req.release_time, EV_ARRIVE, req.time_window[1], -req.demand, req.id)
         
         close_time = self.problem.depot_time_window[1]
-        heapq.heappush(self.event_queue, (close_time + 1e-9, "END", None))
+        self._push_event(close_time + 1e-9, EV_END, 0.0, 0.0, 0)
+
+    def _push_event(self, ev_time: float, kind: int, key1: float, key2: float, obj_id: int,
+                    action: int = ACT_NONE, detail: Optional[int] = None) -> None:
+        self._event_seq += 1
+        heapq.heappush(self.event_queue, (ev_time, kind, key1, key2, self._event_seq, obj_id, action, detail))
+
+    def _push_veh_free(self, ev_time: float, veh: Vehicle, action: int, detail: int) -> None:
+        self._push_event(ev_time, EV_VEH_FREE, veh.id, action, veh.id, action, detail)
 
-    def run(self) -> dict:
+    def run(self, max_events: Optional[int] = None, time_limit: Optional[float] = None,
+            dominance_front: Optional[np.ndarray] = None, dominance_count: int = 1) -> dict:
         """
         Chạy vòng lặp sự kiện chính.
+        max_events: số sự kiện tối đa được xử lý; time_limit: thời gian chạy tối đa (giây, đồng hồ thực).
+        Vượt một trong hai thì dừng sớm, cá thể nhận PENALIZED_FITNESS và results['terminated'] ghi lý do.
+        dominance_front: mảng (k, 2) các điểm (f1, f2) đã biết. Nếu có ít nhất dominance_count điểm trội hẳn
+        cận trên lạc quan của (f1, f2) thì dừng sớm ("dominated"), cá thể nhận chính cận trên đó làm fitness.
         """
+        self.terminated = None
+        self.fitness_bound = None
+        deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        n_events = 0
         while self.event_queue:
-            time, ev_type, payload = heapq.heappop(self.event_queue)
-            self.cur_time = time
+            if max_events is not None and n_events >= max_events:
+                self.terminated = "max_events"
+                break
+            if deadline is not None and n_events % _CLOCK_CHECK_INTERVAL == 0 and time.perf_counter() > deadline:
+                self.terminated = "time_limit"
+                break
+            if dominance_front is not None and n_events % _BOUND_CHECK_INTERVAL == 0 and n_events:
+                bound = self._fitness_upper_bound()
+                dominated = np.all(dominance_front >= bound, axis=1) & np.any(dominance_front > bound, axis=1)
+                if np.count_nonzero(dominated) >= dominance_count:
+                    self.terminated = "dominated"
+                    self.fitness_bound = bound
+                    break
+            n_events += 1
+
+            ev_time, kind, _k1, _k2, _seq, obj_id, action, detail = heapq.heappop(self.event_queue)
+            self.cur_time = ev_time
 
-            if ev_type == "END":
+            if kind == EV_END:
                 break
 
-            if ev_type == "ARRIVE":
-                req_id = payload[1]
-                self._handle_arrive_event(req_id)
+            if kind == EV_ARRIVE:
+                self._handle_arrive_event(obj_id)
 
-            elif ev_type == "VEH_FREE":
-                self._handle_veh_free_event(payload)
+            elif kind == EV_VEH_FREE:
+                self._handle_veh_free_event(obj_id, action, detail)
 
         return self._finalize_results()
 
@@ -86,8 +197,8 @@ class Simulator:
         if not source_req:
             return
 
-        req = copy.deepcopy(source_req)
-        self.problem.requests.append(req)
+        req = source_req.spawn()
+        self.problem.add_request(req)
 
         if self.enable_logging:
             self.log_events.append(f"{self.cur_time:.4f}: ARRIVE req {req.id} at location {req.location}, time_window {req.time_window}")
@@ -96,112 +207,166 @@ class Simulator:
         if req.time_window[1] < self.cur_time:
             return
 
-        # Làm sạch queue xe
-        for veh in self.problem.vehicles:
-            veh.req_queue = [rq for rq in veh.req_queue if (not rq.is_picked_up) and (not rq.is_served)]
+        # Không loại xe nào phục vụ được (theo bảng reachable) -> không đưa vào hàng đợi / pending
+        if not self._reachable_types[req.id]:
+            if self.enable_logging:
+                self.log_events.append(f"{self.cur_time:.4f}: UNREACHABLE req {req.id}")
+            return
 
+        # Hàng đợi được làm sạch lười khi xe được điều phối (_dispatch_vehicle); request bị lấy luôn được
+        # gỡ khỏi hàng đợi của xe nhận nó nên không cần duyệt lại mọi hàng đợi ở mỗi ARRIVE
         success = self._try_assign_request(req, self.problem.vehicles)
 
         if not success:
             if self.enable_logging:
                 self.log_events.append(f"{self.cur_time:.4f}: ADD_TO_PENDING req {req.id} (deadline {req.time_window[1]:.4f})")
-            self.pending_requests.append(req)
+            self._add_pending(req)
 
             # Nếu có xe đang ngủ chờ tại depot, kiểm tra xem request mới có ưu tiên hơn request mà xe đang chờ hay không.
             # Nếu có -> đánh thức xe ngay (push VEH_FREE tại thời điểm hiện tại).
-            for veh in self.problem.vehicles:
-                # chỉ quan tâm xe ở depot có scheduled_wake_time được set
-                if getattr(veh, 'scheduled_wake_time', None) is None:
-                    continue
-                # xe phải đang ở depot (chỉ ngủ ở depot)
-                if veh.current_location != (0.0, 0.0):
-                    continue
-                # scheduled_wake_time ở tương lai (còn đang ngủ)
-                if veh.scheduled_wake_time is None or veh.scheduled_wake_time <= self.cur_time + 1e-9:
-                    continue
+            self._wake_sleeping_vehicles(req)
+
+    def _wake_sleeping_vehicles(self, req: Request) -> None:
+        """
+        Chỉ duyệt các xe trong chỉ mục ngủ (theo waiting_for_s_score giảm dần). Nếu S-tree không phụ thuộc xe,
+        điểm của req như nhau với mọi xe nên dừng ngay ở xe đầu tiên không bị vượt.
+        Xe được đánh thức theo thứ tự trong đội xe (giống thứ tự duyệt cũ).
+        """
+        to_wake = []
+        new_s_score = None
+        for neg_waiting, slot, vid in self._sleeping:
+            veh = self._vehicles_by_id[vid]
+            # scheduled_wake_time ở tương lai (còn đang ngủ)
+            if veh.scheduled_wake_time is None or veh.scheduled_wake_time <= self.cur_time + 1e-9:
+                continue
 
-                # Tính score của request mới theo S-tree trên xe này (lower = better trong dispatch sort)
+            # Tính score của request mới theo S-tree trên xe này (lower = better trong dispatch sort)
+            if new_s_score is None or self._s_uses_vehicle:
                 try:
-                    new_s_score = self.individual.s_tree.evaluate(veh, self.problem, req, self.cur_time)
+                    new_s_score = self.s_eval(veh, self.problem, req, self.cur_time)
                 except Exception:
                     new_s_score = None
+                if new_s_score is None:
+                    continue
 
-                waiting_s = getattr(veh, 'waiting_for_s_score', None)
-                # Nếu xe đang chờ 1 request cụ thể (có điểm s) và request mới tốt hơn thì wake
-                if new_s_score is not None and waiting_s is not None:
-                    if new_s_score < waiting_s - 1e-9:
-                        if self.enable_logging:
-                            self.log_events.append(
-                                f"{self.cur_time:.4f}: WAKE_UP_TRIGGER by ARRIVE req {req.id} for veh {veh.id} "
-                                f"(new_s={new_s_score:.4f} < waiting_s={waiting_s:.4f})"
-                            )
-                        # Push immediate VEH_FREE event to wake vehicle now. Payload as tuple (id, action, detail)
-                        heapq.heappush(self.event_queue, (self.cur_time, "VEH_FREE", (veh.id, "WAKE_UP", req.id)))
-                        # Clear scheduled wake metadata to avoid duplicate wake later
-                        veh.scheduled_wake_time = None
-                        veh.waiting_for_req_id = None
-                        veh.waiting_for_s_score = None
-
-    def _handle_veh_free_event(self, payload: Any):
-        # Normalize payload parsing. Accept:
-        # - simple int (vehicle id)
-        # - tuple (veh_id, action, detail) or (veh_id, action)
-        if isinstance(payload, tuple):
-            if len(payload) == 3:
-                vid, action, detail = payload
-            elif len(payload) == 2:
-                vid, action = payload
-                detail = None
-            else:
-                vid = payload[0]
-                action = "WAKE_UP"
-                detail = None
-        else:
-            vid = payload
-            action = "WAKE_UP"
-            detail = None
+            # Nếu request mới tốt hơn request xe đang chờ thì wake
+            if new_s_score < -neg_waiting - 1e-9:
+                to_wake.append((slot, veh, new_s_score))
+            elif not self._s_uses_vehicle:
+                break
 
+        for _slot, veh, score in sorted(to_wake, key=lambda x: x[0]):
+            if self.enable_logging:
+                self.log_events.append(
+                    f"{self.cur_time:.4f}: WAKE_UP_TRIGGER by ARRIVE req {req.id} for veh {veh.id} "
+                    f"(new_s={score:.4f} < waiting_s={veh.waiting_for_s_score:.4f})"
+                )
+            # Push immediate VEH_FREE event to wake vehicle now
+            self._push_veh_free(self.cur_time, veh, ACT_WAKE_UP, req.id)
+            # Clear scheduled wake metadata to avoid duplicate wake later
+            self._clear_sleeping(veh)
+
+    def _set_sleeping(self, veh: Vehicle, wake_time: float, req_id: int, s_score: float) -> None:
+        """Xe ngủ tại depot tới wake_time, chờ request req_id (điểm S-tree s_score)."""
+        self._clear_sleeping(veh)
+        veh.scheduled_wake_time = wake_time
+        veh.waiting_for_req_id = req_id
+        veh.waiting_for_s_score = s_score
+        # Điểm NaN không bao giờ bị request mới vượt nên không cần đưa vào chỉ mục
+        if s_score == s_score:
+            entry = (-s_score, self._fleet_slot[veh.id], veh.id)
+            bisect.insort(self._sleeping, entry)
+            self._sleep_entries[veh.id] = entry
+
+    def _clear_sleeping(self, veh: Vehicle) -> None:
+        veh.scheduled_wake_time = None
+        veh.waiting_for_req_id = None
+        veh.waiting_for_s_score = None
+        entry = self._sleep_entries.pop(veh.id, None)
+        if entry is not None:
+            del self._sleeping[bisect.bisect_left(self._sleeping, entry)]
+
+    def _handle_veh_free_event(self, vid: int, action: int, detail: Optional[int]):
         # Logging
         if self.enable_logging:
-            if action == "PICKUP":
+            if action == ACT_PICKUP:
                 self.log_events.append(f"{self.cur_time:.4f}: [EVENT] FINISHED PICKUP req {detail} by veh {vid}")
-            elif action == "RETURN":
+            elif action == ACT_RETURN:
                 self.log_events.append(f"{self.cur_time:.4f}: [EVENT] RETURNED DEPOT veh {vid}, served {detail} orders")
-            elif action == "WAKE_UP":
-                self.log_events.append(f"{self.cur_time:.4f}: [EVENT] WAKE UP veh {vid} at Depot (trigger detail={detail})")
             else:
-                self.log_events.append(f"{self.cur_time:.4f}: [EVENT] VEH_FREE veh {vid} action={action} detail={detail}")
+                self.log_events.append(f"{self.cur_time:.4f}: [EVENT] WAKE UP veh {vid} at Depot (trigger detail={detail})")
 
         # Trước khi wake/dispatch, xử lý pending requests chung (nếu có).
         # Điều này cho phép xe vừa RETURN kiểm tra pending và nhận việc ngay nếu phù hợp.
-        if self.pending_requests:
-            # Loại expired
-            self.pending_requests = [r for r in self.pending_requests if self.cur_time <= r.time_window[1] + 1e-6]
-            self.pending_requests.sort(key=lambda r: (r.time_window[1], -r.demand))
-            still_pending = []
-            for p_req in self.pending_requests:
+        # Thử lại ở mọi sự kiện VEH_FREE, kể cả WAKE_UP, trừ khi lượt trước không gán được request nào và từ đó
+        # tới giờ không xe nào đổi trạng thái, không có request mới xuất hiện.
+        # Request bị đẩy lại vào pending trong lượt thử này chờ sự kiện tiếp theo, không được thử lại ngay trong lượt.
+        self._expire_pending()
+        if self.pending_requests and self._pending_stale_key != self._pending_state_key():
+            retry, self.pending_requests = self.pending_requests, []
+            failed = []
+            for entry in retry:
+                p_req = entry[3]
                 success = self._try_assign_request(p_req, self.problem.vehicles)
                 if not success:
-                    still_pending.append(p_req)
+                    failed.append(entry)
                 elif self.enable_logging:
                     self.log_events.append(f"{self.cur_time:.4f}: RETRY_ASSIGN success for pending req {p_req.id}")
-            self.pending_requests = still_pending
+            # failed giữ thứ tự của retry (đã sắp xếp); trộn một lượt với các request mới bị đẩy vào pending
+            if self.pending_requests:
+                self.pending_requests = list(heapq.merge(failed, self.pending_requests))
+            else:
+                self.pending_requests = failed
+            self._pending_stale_key = self._pending_state_key() if len(failed) == len(retry) else None
 
         # Find vehicle object
-        veh = next((v for v in self.problem.vehicles if v.id == vid), None)
+        veh = self._vehicles_by_id.get(vid)
         if not veh:
             return
 
         # If action is RETURN or PICKUP, clear any scheduled wake metadata (vehicle state changed)
-        if action in ("RETURN", "PICKUP"):
-            veh.scheduled_wake_time = None
-            veh.waiting_for_req_id = None
-            veh.waiting_for_s_score = None
+        if action != ACT_WAKE_UP:
+            self._clear_sleeping(veh)
 
-        # Clean queue and dispatch
-        veh.req_queue = [rq for rq in veh.req_queue if (not rq.is_picked_up) and (not rq.is_served)]
+        # Dispatch (hàng đợi được làm sạch trong _dispatch_vehicle)
         self._dispatch_vehicle(veh)
 
+    def _pending_state_key(self) -> Tuple[int, int]:
+        """state_version chỉ tăng nên tổng của chúng không đổi khi và chỉ khi không xe nào đổi trạng thái."""
+        return (sum(veh.state_version for veh in self.problem.vehicles), len(self.problem.requests))
+
+    def _add_pending(self, req: Request) -> None:
+        self._pending_seq += 1
+        bisect.insort(self.pending_requests, (req.time_window[1], -req.demand, self._pending_seq, req))
+
+    def _expire_pending(self) -> None:
+        """Bỏ các request đã quá deadline; do danh sách sắp theo deadline nên chúng luôn nằm ở đầu."""
+        pending = self.pending_requests
+        k = 0
+        while k < len(pending) and self.cur_time > pending[k][0] + 1e-6:
+            k += 1
+        if k:
+            del pending[:k]
+
+    def _fitness_upper_bound(self) -> Tuple[float, float]:
+        """
+        Cận trên lạc quan của (f1, f2) cuối cùng tại thời điểm hiện tại:
+        - f1: mọi request sẽ xuất hiện trước END đều được phục vụ, trừ các request đã mất hẳn (chưa phục vụ,
+          chưa được lấy và đã quá l_i, hoặc không loại xe nào phục vụ được);
+        - f2: busy_until của mỗi xe không bao giờ giảm nên makespan cuối >= makespan hiện tại.
+        """
+        if self._final_total == 0:
+            return (0.0, 0.0)
+        lost = 0
+        for r in self.problem.requests:
+            if r.is_served or r.is_picked_up:
+                continue
+            if self.cur_time > r.time_window[1] + 1e-6 or not self._reachable_types[r.id]:
+                lost += 1
+        close_time = self.problem.depot_time_window[1]
+        makespan = max((v.busy_until for v in self.problem.vehicles), default=0.0)
+        return ((self._final_total - lost) / self._final_total, max(0.0, 1.0 - makespan / close_time))
+
     def _finalize_results(self) -> dict:
         served_count = sum(1 for r in self.problem.requests if r.is_served)
         total = len(self.problem.requests)
@@ -210,6 +375,11 @@ class Simulator:
 
         f1 = served_count / total if total > 0 else 0.0
         f2 = max(0.0, 1.0 - makespan / close_time)
+        terminated = self.terminated
+        if terminated == "dominated":
+            f1, f2 = self.fitness_bound
+        elif terminated is not None:
+            f1, f2 = PENALIZED_FITNESS
 
         self.individual.f1 = f1
         self.individual.f2 = f2
@@ -217,9 +387,11 @@ class Simulator:
 
         if self.enable_logging:
             unserved_ids = [r.id for r in self.problem.requests if not r.is_served]
+            if terminated is not None:
+                self.log_events.append(f"{self.cur_time:.4f}: TERMINATED ({terminated}), fitness penalized")
             self.log_events.append(f"END: Served {served_count}/{total}, Unserved: {unserved_ids}, Makespan: {makespan:.2f}")
 
-        return {
+        results = {
             "total": total,
             "served": served_count,
             "unserved": total - served_count,
@@ -227,11 +399,21 @@ class Simulator:
             "ratio": f1,
             "f1": f1,
             "f2": f2,
+            "replacement_attempts": self.replacement_attempts,
+            "replacement_cycles_skipped": self.replacement_cycles_skipped,
+            "replacement_budget_hits": self.replacement_budget_hits,
+            "terminated": terminated,
+        }
+        if not self.record_routes:
+            return results
+
+        results.update({
             "r_tree": self.individual.r_tree.to_string(),
             "s_tree": self.individual.s_tree.to_string(),
             "simulated_problem": self.problem,
             "log_events": self.log_events if self.enable_logging else None
-        }
+        })
+        return results
 
     # -------------------------
     # Helpers for candidate & ranks
@@ -241,28 +423,42 @@ class Simulator:
         Trả về raw_candidates list tương tự format trước đó:
         mỗi phần tử là dict với keys: veh, r_score, start_service_time, travel_time, arrival_time
         exclude_vehicle_ids: set các id xe cần loại
+        r_score (và kiểm tra range của drone) được lấy từ cache nếu trạng thái xe chưa thay đổi;
+        thời gian bắt đầu / đến nơi luôn tính theo thời điểm hiện tại.
         """
         raw_candidates = []
         exclude_vehicle_ids = exclude_vehicle_ids or set()
+        n_arrived = len(self.problem.requests) if self._r_uses_arrivals else 0
+        at_time = self.cur_time if self._r_uses_time else 0.0
+        req_cache = self._r_score_cache.setdefault(req.id, {})
+        reachable_types = self._reachable_types[req.id]
         for veh in vehicles:
             if veh.id in exclude_vehicle_ids:
                 continue
 
-            # Ràng buộc cho phép DRONE lấy hàng
-            if veh.type == "DRONE" and req.able_drone == 0:
+            # Loại xe không thể phục vụ request (gồm cả DRONE với đơn không cho phép bay)
+            if veh.type not in reachable_types:
                 continue
 
             if req.demand > veh.capacity + 1e-6:
                 continue
 
-            if veh.type == "DRONE" and not veh.check_can_fly(req.location):
+            key = (veh.state_version, n_arrived, at_time)
+            cached = req_cache.get(veh.id)
+            if cached is not None and cached[0] == key:
+                r_score = cached[1]
+            else:
+                if veh.type == "DRONE" and not veh.check_can_fly(req.id):
+                    r_score = None
+                else:
+                    # compute raw r_score
+                    r_score = self.r_eval(veh, self.problem, req, self.cur_time)
+                req_cache[veh.id] = (key, r_score)
+            if r_score is None:
                 continue
 
-            # compute raw r_score
-            r_score = self.individual.r_tree.evaluate(veh, self.problem, req, self.cur_time)
-
             start_service_time = max(self.cur_time, veh.busy_until)
-            travel_time = veh.moving_time_to(req.location)
+            travel_time = veh.travel_time_to(req.id)
             arrival_time = start_service_time + travel_time
 
             raw_candidates.append({
@@ -302,9 +498,67 @@ class Simulator:
 
     def _compute_candidate_list(self, req: Request, vehicles: Iterable[Vehicle], exclude_vehicle_ids: Optional[Set[int]] = None):
         """Trả về danh sách candidates được sắp xếp (combined_score, candidate_dict)"""
+        if self.r_batch_eval is not None and vehicles is self.problem.vehicles:
+            batched = self._compute_candidate_list_batched(req, exclude_vehicle_ids)
+            if batched is not None:
+                return batched
         raw = self._compute_raw_candidates_for_request(req, vehicles, exclude_vehicle_ids)
         return self._compute_combined_candidates(raw)
 
+    def _compute_candidate_list_batched(self, req: Request, exclude_vehicle_ids: Optional[Set[int]] = None):
+        """
+        Như _compute_candidate_list nhưng tính cho toàn đội xe bằng NumPy: mask ràng buộc, R-tree theo từng phần tử,
+        điểm kết hợp r_alpha/arrival_beta và xếp hạng trong một bước. Kết quả giống hệt đường vô hướng.
+        Trả về None nếu điểm R-tree có NaN (để đường vô hướng xử lý đúng ngữ nghĩa min/max/sort của Python).
+        """
+        vehicles = self.problem.vehicles
+        is_drone = self._fleet_is_drone
+        tt = self._fleet_travel_times[self._fleet_type, self._fleet_loc, req.id]
+
+        feasible = self._features['reachable'][self._fleet_type, req.id]
+        feasible &= req.demand <= self._fleet_capacity + 1e-6
+        if exclude_vehicle_ids:
+            feasible &= ~np.isin(self._fleet_ids, list(exclude_vehicle_ids))
+        if is_drone.any():
+            return_time = self._features['return_time'][self._fleet_type, req.id]
+            feasible &= ~is_drone | (self._fleet_range >= tt + return_time)
+
+        idx = np.flatnonzero(feasible)
+        if idx.size == 0:
+            return []
+        cand_vehicles = [vehicles[i] for i in idx.tolist()]
+        fleet = {'tt': tt[idx], 'capacity': self._fleet_capacity[idx], 'is_drone': is_drone[idx]}
+        r_scores = self.r_batch_eval(fleet, cand_vehicles, self.problem, req)
+        if np.isnan(r_scores).any():
+            return None
+
+        start_times = np.maximum(self.cur_time, self._fleet_busy[idx])
+        arr_times = start_times + fleet['tt']
+
+        r_min, r_max = r_scores.min(), r_scores.max()
+        arr_min, arr_max = arr_times.min(), arr_times.max()
+        r_span = r_max - r_min if abs(r_max - r_min) > 1e-9 else 1.0
+        arr_span = arr_max - arr_min if abs(arr_max - arr_min) > 1e-9 else 1.0
+        combined = self.r_alpha * ((r_scores - r_min) / r_span) + self.arrival_beta * (1.0 - ((arr_times - arr_min) / arr_span))
+
+        order = np.argsort(-combined, kind='stable')
+        return [
+            (c, {"veh": cand_vehicles[i], "r_score": r, "start_service_time": st, "travel_time": t, "arrival_time": arr})
+            for i, c, r, st, t, arr in zip(
+                order.tolist(), *(a[order].tolist() for a in (combined, r_scores, start_times, fleet['tt'], arr_times))
+            )
+        ]
+
+    def _sync_fleet(self, veh: Vehicle) -> None:
+        """Cập nhật mảng trạng thái đội xe (dùng cho đường batch) sau khi vị trí / busy_until / range của xe thay đổi."""
+        if self.r_batch_eval is None:
+            return
+        slot = self._fleet_slot[veh.id]
+        self._fleet_loc[slot] = veh.current_loc_idx
+        self._fleet_busy[slot] = veh.busy_until
+        if veh.type == "DRONE":
+            self._fleet_range[slot] = veh.remaining_range
+
     def _get_rank_of_vehicle_for_request(self, req: Request, veh_id: int, candidate_list: List[Tuple[float, Dict]]) -> Optional[int]:
         """Trả về rank (index) của veh_id trong candidate_list, None nếu không nằm trong danh sách"""
         for idx, (_score, cand) in enumerate(candidate_list):
@@ -334,7 +588,7 @@ class Simulator:
         capacity = veh.capacity
 
         if sum_top_demand + req.demand <= capacity + 1e-6:
-            veh.req_queue.append(req)
+            veh.enqueue(req)
             if self.enable_logging:
                 self.log_events.append(f"{self.cur_time:.4f}: ASSIGN_DIRECT req {req.id} -> veh {veh.id}")
             if veh.busy_until <= self.cur_time + 1e-6:
@@ -367,13 +621,10 @@ class Simulator:
 
         if removed_reqs and (sum_top_demand - freed + req.demand <= capacity + 1e-6):
             for q in removed_reqs:
-                try:
-                    veh.req_queue.remove(q)
-                except ValueError:
-                    pass
+                veh.remove_from_queue(q)
                 q.is_picked_up = False
                 q.pickup_time = None
-            veh.req_queue.append(req)
+            veh.enqueue(req)
             if self.enable_logging:
                 removed_ids = [r.id for r in removed_reqs]
                 self.log_events.append(f"{self.cur_time:.4f}: REPLACE on veh {veh.id}: removed {removed_ids} -> added req {req.id}")
@@ -391,11 +642,7 @@ class Simulator:
         Cố gắng gán request cho vehicles...
         """
         exclude_vehicle_ids = exclude_vehicle_ids or set()
-        if hasattr(req, 'cached_candidates') and req.cached_candidates is not None:
-             cand_list = req.cached_candidates
-        else:
-             cand_list = self._compute_candidate_list(req, self.problem.vehicles, exclude_vehicle_ids)
-             req.cached_candidates = cand_list
+        cand_list = self._compute_candidate_list(req, self.problem.vehicles, exclude_vehicle_ids)
 
         if not cand_list:
             if self.enable_logging:
@@ -403,7 +650,12 @@ class Simulator:
             return False
 
         assigned_any = False
-        to_reassign_queue: List[Tuple[Request, Optional[int]]] = []
+        to_reassign_queue: deque[Tuple[Request, Optional[int]]] = deque()
+        # Các cặp (request, xe) đã được gán trong chuỗi này: gán lại đúng cặp đó là vòng lặp qua lại, bỏ qua
+        visited: Set[Tuple[int, int]] = set()
+        budget = self.replacement_budget
+        # True khi ngân sách hết trong lúc vẫn còn lần thử gán lại chưa được thực hiện
+        budget_exhausted = False
 
         for combined_score, cand in cand_list:
             veh = cand["veh"]
@@ -417,35 +669,50 @@ class Simulator:
             ok, removed = self._attempt_assign_to_vehicle(req, veh, combined_score)
             if ok:
                 assigned_any = True
+                visited.add((req.id, veh.id))
                 for rr in removed:
                     to_reassign_queue.append((rr, veh.id))
                 break
 
         while to_reassign_queue:
-            removed_req, removed_from_vid = to_reassign_queue.pop(0)
-            if hasattr(removed_req, 'cached_candidates'):
-                removed_cands = removed_req.cached_candidates
+            removed_req, removed_from_vid = to_reassign_queue.popleft()
+            reassigned = False
+            if budget <= 0:
+                budget_exhausted = True
             else:
                 removed_cands = self._compute_candidate_list(removed_req, self.problem.vehicles)
-            start_idx = 0
-            for idx, (_sc, cd) in enumerate(removed_cands):
-                if cd["veh"].id == removed_from_vid:
-                    start_idx = idx + 1
-                    break
-            reassigned = False
-            for idx in range(start_idx, len(removed_cands)):
-                sc, cd = removed_cands[idx]
-                target_veh = cd["veh"]
-                ok, further_removed = self._attempt_assign_to_vehicle(removed_req, target_veh, sc)
-                if ok:
-                    reassigned = True
-                    for fr in further_removed:
-                        to_reassign_queue.append((fr, target_veh.id))
-                    break
+                start_idx = 0
+                for idx, (_sc, cd) in enumerate(removed_cands):
+                    if cd["veh"].id == removed_from_vid:
+                        start_idx = idx + 1
+                        break
+                for idx in range(start_idx, len(removed_cands)):
+                    sc, cd = removed_cands[idx]
+                    target_veh = cd["veh"]
+                    if (removed_req.id, target_veh.id) in visited:
+                        self.replacement_cycles_skipped += 1
+                        continue
+                    if budget <= 0:
+                        budget_exhausted = True
+                        break
+                    budget -= 1
+                    self.replacement_attempts += 1
+                    ok, further_removed = self._attempt_assign_to_vehicle(removed_req, target_veh, sc)
+                    if ok:
+                        reassigned = True
+                        visited.add((removed_req.id, target_veh.id))
+                        for fr in further_removed:
+                            to_reassign_queue.append((fr, target_veh.id))
+                        break
             if not reassigned:
                 if self.enable_logging:
                     self.log_events.append(f"{self.cur_time:.4f}: PUSH_TO_PENDING removed req {removed_req.id} after replacement attempts")
-                self.pending_requests.append(removed_req)
+                self._add_pending(removed_req)
+
+        if budget_exhausted:
+            self.replacement_budget_hits += 1
+            if self.enable_logging:
+                self.log_events.append(f"{self.cur_time:.4f}: REPLACEMENT_BUDGET exhausted in cascade of req {req.id}")
 
         return assigned_any
 
@@ -459,7 +726,7 @@ class Simulator:
         xe sẽ ngủ tại Depot thay vì đi đến khách hàng rồi đứng chờ.
         """
         # Làm sạch hàng đợi (loại bỏ đơn đã xử lý)
-        veh.req_queue = [rq for rq in veh.req_queue if (not rq.is_picked_up) and (not rq.is_served)]
+        veh.prune_queue()
 
         # Thời điểm xe sẵn sàng
         ready_time = max(self.cur_time, veh.busy_until)
@@ -467,7 +734,7 @@ class Simulator:
 
         # 1. Kiểm tra l_w (Max Wait Time) của các đơn đã nhặt trên xe (nếu có)
         if veh.picked_up_orders:
-            time_to_depot = veh.moving_time(veh.current_location, (0, 0))
+            time_to_depot = veh.return_times[veh.current_loc_idx]
             arrival_at_depot = ready_time + time_to_depot
             for picked in veh.picked_up_orders:
                 if (arrival_at_depot - picked.pickup_time > picked.l_w + 1e-6):
@@ -477,47 +744,15 @@ class Simulator:
                     self._execute_failed_return_sequence(veh, picked, ready_time, note="Violate depot time window")
                     return
 
-        # 2. Duyệt qua hàng đợi để tìm ứng viên tốt nhất
-        candidates = []
-        
-        for req in veh.req_queue:
-            if req.is_served or req.is_picked_up: continue
-
-            travel_time = veh.moving_time_to(req.location)
-            jit_departure_time = req.time_window[0] - travel_time
-            arrival_if_go_now = ready_time + travel_time
-            service_start = max(arrival_if_go_now, req.time_window[0])
-
-            # KIỂM TRA RÀNG BUỘC
-            if arrival_if_go_now > req.time_window[1] + 1e-6: continue
-            arrival_depot_after = service_start + veh.moving_time(req.location, (0, 0))
-            if arrival_depot_after > depot_close + 1e-6: continue
-            if any((arrival_depot_after - p.pickup_time > p.l_w + 1e-6) for p in veh.picked_up_orders):
-                continue
-            if (arrival_depot_after - service_start > req.l_w + 1e-6):
-                continue
-            if veh.type == "DRONE":
-                total_dist_time = (veh.distance_to(req.location) + \
-                                  math.sqrt(req.location[0]**2 + req.location[1]**2)) / veh.velocity
-                if veh.remaining_range < total_dist_time - 1e-6: continue
-            if veh.remaining_capacity < req.demand - 1e-6:
-                continue
-
-            # TÍNH ĐIỂM S-TREE
-            score = self.individual.s_tree.evaluate(veh, self.problem, req, self.cur_time)
-            
-            candidates.append({
-                'score': score,
-                'req': req,
-                'travel_time': travel_time,
-                'service_start': service_start,
-                'jit_departure_time': jit_departure_time
-            })
+        # 2. Duyệt qua hàng đợi để tìm ứng viên tốt nhất (điểm S-tree nhỏ nhất, hòa thì đi gần hơn)
+        best = False
+        if veh.req_queue and len(veh.req_queue) >= self.batch_min_queue and self.individual.s_batch_func is not None:
+            best = self._select_request_batched(veh, ready_time, depot_close)
+        if best is False:
+            best = self._select_request(veh, ready_time, depot_close)
 
         # 3. Ra quyết định
-        if candidates:
-            candidates.sort(key=lambda x: (x['score'], x['travel_time']))
-            best = candidates[0]
+        if best is not None:
             req_to_serve = best['req']
             
             # --- LOGIC CHỜ (JUST-IN-TIME) ---
@@ -534,10 +769,8 @@ class Simulator:
                         )
                     
                     # Schedule VEH_FREE with detailed payload and record waiting meta
-                    veh.scheduled_wake_time = wake_up_time
-                    veh.waiting_for_req_id = best['req'].id
-                    veh.waiting_for_s_score = best['score']
-                    heapq.heappush(self.event_queue, (wake_up_time, "VEH_FREE", (veh.id, "WAKE_UP", best['req'].id)))
+                    self._set_sleeping(veh, wake_up_time, best['req'].id, best['score'])
+                    self._push_veh_free(wake_up_time, veh, ACT_WAKE_UP, best['req'].id)
                     return
             
             # Nếu không chờ nữa -> dispatch ngay
@@ -545,48 +778,140 @@ class Simulator:
                 self.log_events.append(f"{self.cur_time:.4f}: [DECISION] DISPATCH veh {veh.id} from {veh.current_location} to req {best['req'].id}. Travel: {best['travel_time']:.2f}")
 
             # Clear scheduled wake metadata
-            veh.scheduled_wake_time = None
-            veh.waiting_for_req_id = None
-            veh.waiting_for_s_score = None
+            self._clear_sleeping(veh)
 
             self._execute_pickup(veh, req_to_serve, ready_time, best['travel_time'], best['service_start'])
             return
 
         # 4. Nếu không có đơn nào -> return hoặc log
-        if not candidates and veh.current_location != (0, 0):
+        if veh.current_location != (0, 0):
             self._process_final_return(veh, ready_time)
         
-        elif not candidates and veh.current_location == (0, 0):
+        else:
             if self.enable_logging:
                 self.log_events.append(f"{ready_time:.4f}: NO_CANDIDATES veh {veh.id} at depot")
 
+    def _select_request(self, veh: Vehicle, ready_time: float, depot_close: float) -> Optional[Dict[str, Any]]:
+        """Duyệt từng request trong hàng đợi, trả về ứng viên có (score, travel_time) nhỏ nhất hoặc None."""
+        best = None
+        best_key = None
+
+        for req in veh.req_queue:
+            if req.is_served or req.is_picked_up: continue
+
+            travel_time = veh.travel_time_to(req.id)
+            arrival_if_go_now = ready_time + travel_time
+            service_start = max(arrival_if_go_now, req.time_window[0])
+
+            # KIỂM TRA RÀNG BUỘC
+            if arrival_if_go_now > req.time_window[1] + 1e-6: continue
+            arrival_depot_after = service_start + veh.return_times[req.id]
+            if arrival_depot_after > depot_close + 1e-6: continue
+            if any((arrival_depot_after - p.pickup_time > p.l_w + 1e-6) for p in veh.picked_up_orders):
+                continue
+            if (arrival_depot_after - service_start > req.l_w + 1e-6):
+                continue
+            if veh.type == "DRONE":
+                total_dist_time = (veh.distance_to_index(req.id) + veh.depot_distances[req.id]) / veh.velocity
+                if veh.remaining_range < total_dist_time - 1e-6: continue
+            if veh.remaining_capacity < req.demand - 1e-6:
+                continue
+
+            # TÍNH ĐIỂM S-TREE; chỉ giữ ứng viên tốt nhất (giống min(), ứng viên đầu tiên thắng khi hòa)
+            score = self.s_eval(veh, self.problem, req, self.cur_time)
+            key = (score, travel_time)
+            if best_key is None or key < best_key:
+                best_key = key
+                best = {
+                    'score': score,
+                    'req': req,
+                    'travel_time': travel_time,
+                    'service_start': service_start,
+                    'jit_departure_time': req.time_window[0] - travel_time
+                }
+
+        return best
+
+    def _select_request_batched(self, veh: Vehicle, ready_time: float, depot_close: float):
+        """
+        Như _select_request nhưng tính mask ràng buộc và terminal ST cho cả hàng đợi bằng NumPy,
+        đánh giá S-tree một lần rồi chọn bằng argmin. Hàng đợi đã được prune_queue nên không còn đơn đã lấy/đã phục vụ.
+        Trả về False nếu điểm có NaN (để đường vô hướng xử lý đúng ngữ nghĩa so sánh của Python).
+        """
+        queue = veh.req_queue
+        features = self._features
+        ids = np.array([req.id for req in queue], dtype=np.intp)
+        tt = self._type_travel_times[veh.type][veh.current_loc_idx, ids]
+        tw0 = features['tw0'][ids]
+        tw1 = features['tw1'][ids]
+        demand = features['demand'][ids]
+
+        arrival_if_go_now = ready_time + tt
+        service_start = np.maximum(arrival_if_go_now, tw0)
+        arrival_depot_after = service_start + self._type_return_times[veh.type][ids]
+
+        feasible = arrival_if_go_now <= tw1 + 1e-6
+        feasible &= arrival_depot_after <= depot_close + 1e-6
+        for p in veh.picked_up_orders:
+            feasible &= arrival_depot_after - p.pickup_time <= p.l_w + 1e-6
+        feasible &= arrival_depot_after - service_start <= features['l_w'][ids] + 1e-6
+        if veh.type == "DRONE":
+            total_dist_time = (self._distance_array[veh.current_loc_idx, ids] + features['depot_distance'][ids]) / veh.velocity
+            feasible &= veh.remaining_range >= total_dist_time - 1e-6
+        feasible &= veh.remaining_capacity >= demand - 1e-6
+
+        idx = np.flatnonzero(feasible)
+        if idx.size == 0:
+            return None
+        feat = {
+            'tt': tt[idx], 'tw0': tw0[idx], 'tw1': tw1[idx], 'demand': demand[idx],
+            'release': features['release'][ids[idx]],
+        }
+        scores = self.individual.s_batch_func(feat, veh, self.problem, self.cur_time)
+        if np.isnan(scores).any():
+            return False
+
+        # argmin theo (score, travel_time): lấy các điểm nhỏ nhất, rồi travel_time nhỏ nhất (phần tử đầu tiên khi hòa)
+        ties = np.flatnonzero(scores == scores.min())
+        pos = ties[np.argmin(feat['tt'][ties])]
+        i = int(idx[pos])
+        travel_time = float(tt[i])
+        return {
+            'score': float(scores[pos]),
+            'req': queue[i],
+            'travel_time': travel_time,
+            'service_start': float(service_start[i]),
+            'jit_departure_time': queue[i].time_window[0] - travel_time
+        }
+
     def _execute_pickup(self, veh: Vehicle, next_req: Request, ready_time: float, travel_time: float, service_start: float) -> None:
         """Thực hiện hành động lấy hàng và cập nhật trạng thái."""
         arrival_time = ready_time + travel_time
 
-        if veh.current_location == (0.0, 0.0):
+        if self.record_routes and veh.current_location == (0.0, 0.0):
             veh.routes.append([])
 
         if veh.type == "DRONE":
-            veh.remaining_range -= veh.moving_time_to(next_req.location)
+            veh.remaining_range -= veh.travel_time_to(next_req.id)
 
-        entry = {
-            'action': 'pickup',
-            'req_id': next_req.id,
-            'ready_time': ready_time,
-            'travel_time': travel_time,
-            'arrival_time': arrival_time,
-            'service_start': service_start,
-            'location': next_req.location,
-            'prev_location': veh.current_location,
-            'vehicle_state': {
-                'busy_until': service_start,
-                'remaining_capacity': veh.remaining_capacity - next_req.demand,
-                'remaining_range': veh.remaining_range if veh.type == 'DRONE' else None
-            },
-            'note': None
-        }
-        veh.routes[-1].append(entry)
+        if self.record_routes:
+            entry = {
+                'action': 'pickup',
+                'req_id': next_req.id,
+                'ready_time': ready_time,
+                'travel_time': travel_time,
+                'arrival_time': arrival_time,
+                'service_start': service_start,
+                'location': next_req.location,
+                'prev_location': veh.current_location,
+                'vehicle_state': {
+                    'busy_until': service_start,
+                    'remaining_capacity': veh.remaining_capacity - next_req.demand,
+                    'remaining_range': veh.remaining_range if veh.type == 'DRONE' else None
+                },
+                'note': None
+            }
+            veh.routes[-1].append(entry)
 
         # Cập nhật trạng thái
         next_req.is_picked_up = True
@@ -595,41 +920,43 @@ class Simulator:
         veh.remaining_capacity -= next_req.demand
         veh.picked_up_orders.append(next_req)
         veh.current_location = next_req.location
+        veh.current_loc_idx = next_req.id
         veh.busy_until = service_start
-        veh.req_queue = [r for r in veh.req_queue if r.id != next_req.id]
+        veh.remove_from_queue(next_req)
+        veh.state_version += 1
+        self._sync_fleet(veh)
 
         # Clear any scheduled wake (we are now busy)
-        veh.scheduled_wake_time = None
-        veh.waiting_for_req_id = None
-        veh.waiting_for_s_score = None
+        self._clear_sleeping(veh)
 
-        heapq.heappush(self.event_queue, (veh.busy_until, "VEH_FREE", (veh.id, "PICKUP", next_req.id)))
+        self._push_veh_free(veh.busy_until, veh, ACT_PICKUP, next_req.id)
 
     def _process_final_return(self, veh: Vehicle, ready_time: float) -> None:
         """Quay về depot và hoàn tất các đơn hàng."""
-        travel_time = veh.moving_time_to((0.0, 0.0))
+        travel_time = veh.return_times[veh.current_loc_idx]
         arrival_at_depot = ready_time + travel_time
 
         if veh.type == "DRONE":
             veh.recharge()
 
-        entry = {
-            'action': 'return_depot',
-            'req_id': None,
-            'ready_time': ready_time,
-            'travel_time': travel_time,
-            'arrival_time': arrival_at_depot,
-            'service_start': None,
-            'location': (0.0, 0.0),
-            'prev_location': veh.current_location,
-            'vehicle_state': {
-                'remaining_capacity': veh.capacity,
-                'busy_until': arrival_at_depot,
-                'remaining_range': veh.max_range if veh.type == 'DRONE' else None
-            },
-            'note': None
-        }
-        veh.routes[-1].append(entry)
+        if self.record_routes:
+            entry = {
+                'action': 'return_depot',
+                'req_id': None,
+                'ready_time': ready_time,
+                'travel_time': travel_time,
+                'arrival_time': arrival_at_depot,
+                'service_start': None,
+                'location': (0.0, 0.0),
+                'prev_location': veh.current_location,
+                'vehicle_state': {
+                    'remaining_capacity': veh.capacity,
+                    'busy_until': arrival_at_depot,
+                    'remaining_range': veh.max_range if veh.type == 'DRONE' else None
+                },
+                'note': None
+            }
+            veh.routes[-1].append(entry)
 
         for r in veh.picked_up_orders:
             r.is_served = True
@@ -637,46 +964,48 @@ class Simulator:
         veh.picked_up_orders = []
         veh.busy_until = arrival_at_depot
         veh.current_location = (0.0, 0.0)
+        veh.current_loc_idx = 0
         veh.remaining_capacity = veh.capacity
+        veh.state_version += 1
+        self._sync_fleet(veh)
 
         # Clear any scheduled wake (we're back at depot after a return)
-        veh.scheduled_wake_time = None
-        veh.waiting_for_req_id = None
-        veh.waiting_for_s_score = None
+        self._clear_sleeping(veh)
 
-        heapq.heappush(self.event_queue, (veh.busy_until, "VEH_FREE", (veh.id, "RETURN", served)))
+        self._push_veh_free(veh.busy_until, veh, ACT_RETURN, served)
 
     def _execute_failed_return_sequence(self, veh: Vehicle, urgent_req: Request, ready_time: float, note: str) -> None:
         """Xử lý trường hợp bắt buộc phải trả hàng do vi phạm ràng buộc thời gian (failed return)."""
-        travel_to_cust = veh.moving_time_to(urgent_req.location)
+        travel_to_cust = veh.travel_time_to(urgent_req.id)
         arrival_at_cust = ready_time + travel_to_cust
 
         if self.enable_logging:
             self.log_events.append(f"{arrival_at_cust:.4f}: FAILED_RETURN req {urgent_req.id} by veh {veh.id}, note: {note}")
 
-        if not veh.routes:
+        if self.record_routes and not veh.routes:
             veh.routes.append([])
 
         if veh.type == "DRONE":
-            veh.remaining_range -= veh.moving_time_to(urgent_req.location)
-
-        entry = {
-            'action': 'failed_return',
-            'req_id': urgent_req.id,
-            'ready_time': ready_time,
-            'travel_time': travel_to_cust,
-            'arrival_time': arrival_at_cust,
-            'service_start': None,
-            'location': urgent_req.location,
-            'prev_location': veh.current_location,
-            'vehicle_state': {
-                'remaining_capacity': veh.remaining_capacity + urgent_req.demand,
-                'busy_until': arrival_at_cust,
-                'remaining_range': veh.remaining_range if veh.type == 'DRONE' else None
-            },
-            'note': note
-        }
-        veh.routes[-1].append(entry)
+            veh.remaining_range -= veh.travel_time_to(urgent_req.id)
+
+        if self.record_routes:
+            entry = {
+                'action': 'failed_return',
+                'req_id': urgent_req.id,
+                'ready_time': ready_time,
+                'travel_time': travel_to_cust,
+                'arrival_time': arrival_at_cust,
+                'service_start': None,
+                'location': urgent_req.location,
+                'prev_location': veh.current_location,
+                'vehicle_state': {
+                    'remaining_capacity': veh.remaining_capacity + urgent_req.demand,
+                    'busy_until': arrival_at_cust,
+                    'remaining_range': veh.remaining_range if veh.type == 'DRONE' else None
+                },
+                'note': note
+            }
+            veh.routes[-1].append(entry)
 
         # Reset trạng thái request
         urgent_req.is_picked_up = False
@@ -684,16 +1013,17 @@ class Simulator:
 
         # Nếu vẫn còn trong time window thì ném lại vào pending để xử lý sau
         if arrival_at_cust <= urgent_req.time_window[1] + 1e-6:
-            self.pending_requests.append(urgent_req)
+            self._add_pending(urgent_req)
 
         veh.current_location = urgent_req.location
+        veh.current_loc_idx = urgent_req.id
         veh.busy_until = arrival_at_cust
         veh.remaining_capacity += urgent_req.demand
         veh.picked_up_orders = [p for p in veh.picked_up_orders if p.id != urgent_req.id]
+        veh.state_version += 1
+        self._sync_fleet(veh)
 
         # Clear any scheduled wake (we are busy)
-        veh.scheduled_wake_time = None
-        veh.waiting_for_req_id = None
-        veh.waiting_for_s_score = None
+        self._clear_sleeping(veh)
 
-        heapq.heappush(self.event_queue, (veh.busy_until, "VEH_FREE", (veh.id, "RETURN", urgent_req.id)))
\ No newline at end of file
+        self._push_veh_free(veh.busy_until, veh, ACT_RETURN, urgent_req.id)
\ No newline at end of file
@@ -3,7 +3,7 @@ import os
 import yaml
 from typing import Optional, Literal
 from ..GP_Solution.gp_structure import Individual
-from ..GP_Solution.problem_structures import Problem, Vehicle
+from ..GP_Solution.problem_structures import Problem, Vehicle, SimulationState
 
 def save_results(
     results_number: Optional[int],
@@ -32,7 +32,7 @@ def save_results(
     #     yaml.dump(config, f, default_flow_style=False, sort_keys=False)
     
     # 2. Lưu best_indi.json
-    sim_pro: Problem = final_results['simulated_problem']
+    sim_pro: SimulationState = final_results['simulated_problem']
     last_ind_data = {
         "execution_time": execution_time,
         "served": final_results['served'],